@@ -0,0 +1,112 @@
+""" Runs every benchmark and saves the results as JSON
+
+    $ python -m benchmarks
+    $ python -m benchmarks --only tick,stream --output new.json
+    $ python -m benchmarks --compare old.json
+
+The results go to benchmarks/results/<commit>.json by default, so that two
+commits can be compared with --compare (which runs the benchmarks and shows
+how every number changed since the old results).
+
+Each benchmark can also be ran on its own, with a readable output (python -m
+benchmarks.tick for example).
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks import collisions, stream, tick, wire
+
+SUITES = {
+    'wire': wire,
+    'stream': stream,
+    'collisions': collisions,
+    'tick': tick,
+}
+
+# the keys that identify a result, rather than measure something
+KEYS = 'backend', 'players', 'codec', 'message'
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(names):
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = SUITES[name].run()
+    return results
+
+def compare(old, new):
+    """ Prints how every measure changed between two runs """
+    for name, results in new['results'].items():
+        old_results = {
+            tuple(r.get(key) for key in KEYS): r
+            for r in old['results'].get(name, [])
+        }
+        for result in results:
+            ident = tuple(result.get(key) for key in KEYS)
+            before = old_results.get(ident)
+            if before is None:
+                continue
+            label = " ".join(f"{key}={value}"
+                             for key, value in zip(KEYS, ident)
+                             if value is not None)
+            for measure, value in result.items():
+                if measure in KEYS or not before.get(measure):
+                    continue
+                change = (value - before[measure]) / before[measure] * 100
+                print(f"{name:>10} {label:<30} {measure:<18} "
+                      f"{before[measure]:>12.3f} -> {value:>12.3f} "
+                      f"({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', help="comma separated benchmarks "
+                        f"(from {', '.join(SUITES)})")
+    parser.add_argument('--output', help="where to save the results")
+    parser.add_argument('--compare', help="results to compare with")
+    args = parser.parse_args()
+
+    # the game logs a lot, it shouldn't be part of the measure
+    logging.disable(logging.CRITICAL)
+
+    names = args.only.split(',') if args.only else list(SUITES)
+    for name in names:
+        if name not in SUITES:
+            parser.error(f"unknown benchmark {name!r}")
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': run(names),
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+""" Collision checks per tick against the number of players
+
+    $ python -m benchmarks.collisions
+
+Compares the spatial index (server.spatial.Grid) with checking every pair of
+players. The players are spread on a map that grows with their number, so that
+the density stays about the same as 100 players on MAP_SIZE.
+"""
+
+import itertools
+import math
+import random
+import timeit
+
+from constants import *
+from server.player import Player
+from server.spatial import Grid
+
+PLAYER_COUNTS = 10, 100, 500, 1000
+
+def make_players(count):
+    scale = math.sqrt(max(count, 100) / 100)
+    players = []
+    for _ in range(count):
+        player = Player(None)
+        player.spawn((random.uniform(0, MAP_SIZE[0] * scale),
+                      random.uniform(0, MAP_SIZE[1] * scale)))
+        players.append(player)
+    return players
+
+def grid_tick(grid):
+    return sum(1 for a, b in grid.candidate_pairs() if a.collides(b))
+
+def all_pairs_tick(players):
+    return sum(1 for a, b in itertools.combinations(players, 2)
+               if a.collides(b))
+
+def run(player_counts=PLAYER_COUNTS, number=5):
+    results = []
+    for count in player_counts:
+        players = make_players(count)
+        grid = Grid(GRID_CELL_SIZE)
+        for player in players:
+            grid.insert(player)
+
+        result = {
+            "players": count,
+            "grid_checks": sum(1 for _ in grid.candidate_pairs()),
+            "all_pairs_checks": count * (count - 1) // 2,
+            "grid_ms": timeit.timeit(lambda: grid_tick(grid),
+                                     number=number) / number * 1000,
+            "all_pairs_ms": timeit.timeit(lambda: all_pairs_tick(players),
+                                          number=number) / number * 1000,
+        }
+        assert grid_tick(grid) == all_pairs_tick(players)
+        results.append(result)
+    return results
+
+def main():
+    print(f"{'players':>8} {'checks (grid)':>14} {'checks (all)':>14} "
+          f"{'ms (grid)':>10} {'ms (all)':>10}")
+    for r in run():
+        print(f"{r['players']:>8} {r['grid_checks']:>14} "
+              f"{r['all_pairs_checks']:>14} {r['grid_ms']:>10.2f} "
+              f"{r['all_pairs_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+""" Headless bots to put some load on a running server
+
+    $ python main.py server
+    $ python -m benchmarks.loadgen --players 10,100,1000 --duration 10
+
+For every player count, that many bots join the game (at the same time), press
+random keys for a while, and leave. They speak the same protocol as the real
+client (username handshake, keyboard, ack, ping), but over TCP only, and
+without pygame. With --processes, the bots are spread over several processes,
+so that the bots themselves aren't the bottleneck.
+
+It reports, for every player count:
+
+- join: from connecting to being accepted
+- latency: from the server simulating a state (the "time" of the update) to
+  the bot reading it. The clocks are synced with net.ClockSync, so it's only
+  as good as the RTT estimate.
+- jitter: the difference between the time between two updates and
+  SERVER_REFRESH_RATE
+- bytes: received per bot per second
+
+Thousands of bots need as many file descriptors (see ulimit -n).
+"""
+
+import argparse
+import logging
+import math
+import multiprocessing
+import random
+import trio
+import net
+import wire
+from constants import *
+
+log = logging.getLogger(__name__)
+
+PLAYER_COUNTS = 10, 100, 1000
+PERCENTILES = 50, 99, 99.9
+
+# how often the bots change their keyboard state, in seconds (at random)
+KEYBOARD_CHANGES = .1, 1
+
+def quiet_logs():
+    logging.basicConfig(level=logging.WARNING)
+    # net logs every message
+    logging.getLogger('net').setLevel(logging.WARNING)
+
+def percentile(values, p):
+    """ Nearest rank percentile of values (sorted) """
+    if not values:
+        return math.nan
+    rank = math.ceil(p / 100 * len(values))
+    return values[max(rank, 1) - 1]
+
+class Samples:
+
+    def __init__(self):
+        self.join = []
+        self.latency = []
+        self.jitter = []
+        # bytes per second, for every bot
+        self.bytes = []
+        self.errors = 0
+
+    def merge(self, other):
+        self.join += other.join
+        self.latency += other.latency
+        self.jitter += other.jitter
+        self.bytes += other.bytes
+        self.errors += other.errors
+
+    def summary(self):
+        summary = {'errors': self.errors}
+        for name in ('join', 'latency', 'jitter', 'bytes'):
+            values = sorted(getattr(self, name))
+            summary[name] = {f"p{p:g}": percentile(values, p)
+                             for p in PERCENTILES}
+        return summary
+
+class Bot:
+
+    def __init__(self, username, samples):
+        self.username = username
+        self.samples = samples
+        self.keyboard_seq = 0
+        self.last_update = None
+
+    async def run(self, host, port):
+        start = trio.current_time()
+        stream = net.JSONStream(await trio.open_tcp_stream(host, port))
+        try:
+            await stream.write({
+                'type': 'username',
+                'username': self.username,
+                'codecs': PREFERRED_CODECS,
+            })
+            resp = await stream.read()
+            if resp['type'] != 'accepted':
+                raise ValueError(f"{self.username} wasn't accepted: {resp}")
+            stream.codec = wire.CODECS[resp.get('codec', 'json')]
+            joined = trio.current_time()
+            self.samples.join.append(joined - start)
+
+            try:
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(self.press_keys_forever, stream)
+                    nursery.start_soon(self.sync_clock_forever, stream)
+                    await self.read_forever(stream)
+                    # dead: stop sending keys and pings too
+                    nursery.cancel_scope.cancel()
+            finally:
+                elapsed = trio.current_time() - joined
+                if elapsed > 0:
+                    self.samples.bytes.append(stream.bytes_received / elapsed)
+        finally:
+            with trio.CancelScope(shield=True):
+                await stream.aclose()
+
+    async def press_keys_forever(self, stream):
+        while True:
+            self.keyboard_seq += 1
+            await stream.write({
+                'type': 'keyboard',
+                'state': random.choice((0, UP, RIGHT, DOWN, LEFT,
+                                        UP | RIGHT, DOWN | LEFT)),
+                'seq': self.keyboard_seq,
+            })
+            await trio.sleep(random.uniform(*KEYBOARD_CHANGES))
+
+    async def sync_clock_forever(self, stream):
+        while True:
+            await stream.ping()
+            await trio.sleep(CLOCK_SYNC_INTERVAL)
+
+    async def read_forever(self, stream):
+        while True:
+            msg = await stream.read()
+            now = trio.current_time()
+            if msg['type'] == 'pong':
+                stream.clock.handle_pong(msg, now)
+            elif msg['type'] == 'update':
+                self.handle_update(stream, msg, now)
+                await stream.write({'type': 'ack', 'seq': msg['seq']})
+            elif msg['type'] == 'dead':
+                # killed, it happens a lot with lots of bots
+                return
+
+    def handle_update(self, stream, update, now):
+        if stream.clock.synced:
+            self.samples.latency.append(
+                now - stream.clock.local_time(update['time']))
+        if self.last_update is not None:
+            self.samples.jitter.append(
+                abs(now - self.last_update - SERVER_REFRESH_RATE))
+        self.last_update = now
+
+async def run_bots(host, port, usernames, duration):
+    samples = Samples()
+
+    async def run_bot(username):
+        try:
+            await Bot(username, samples).run(host, port)
+        except (OSError, net.ConnectionClosed, ValueError) as e:
+            log.warning(f"{username} failed: {e}")
+            samples.errors += 1
+
+    with trio.move_on_after(duration):
+        async with trio.open_nursery() as nursery:
+            for username in usernames:
+                nursery.start_soon(run_bot, username)
+    return samples
+
+def run_bots_process(host, port, usernames, duration):
+    """ Entry point of the processes (see --processes) """
+    quiet_logs()
+    return trio.run(run_bots, host, port, usernames, duration)
+
+def run(player_counts=PLAYER_COUNTS, duration=10, processes=1,
+        host='localhost', port=PORT):
+    results = []
+    for number, count in enumerate(player_counts):
+        usernames = [f"bot{number}-{i}" for i in range(count)]
+        chunks = [usernames[i::processes] for i in range(processes)]
+
+        samples = Samples()
+        if processes == 1:
+            samples = trio.run(run_bots, host, port, usernames, duration)
+        else:
+            context = multiprocessing.get_context('spawn')
+            with context.Pool(processes) as pool:
+                for result in pool.starmap(run_bots_process, [
+                        (host, port, chunk, duration) for chunk in chunks]):
+                    samples.merge(result)
+
+        results.append({'players': count, **samples.summary()})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--players', default=','.join(map(str, PLAYER_COUNTS)),
+                        help="comma separated player counts")
+    parser.add_argument('--duration', type=float, default=10,
+                        help="seconds for every player count")
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    quiet_logs()
+    player_counts = [int(count) for count in args.players.split(',')]
+
+    print(f"{'players':>8} {'':>8} {'p50':>9} {'p99':>9} {'p99.9':>9}")
+    for r in run(player_counts, args.duration, args.processes,
+                 args.host, args.port):
+        for name, unit, scale in (('join', 'ms', 1000),
+                                  ('latency', 'ms', 1000),
+                                  ('jitter', 'ms', 1000),
+                                  ('bytes', 'kB/s', 1 / 1000)):
+            values = [r[name][f"p{p:g}"] * scale for p in PERCENTILES]
+            print(f"{r['players']:>8} {name:>8} "
+                  + " ".join(f"{value:>9.2f}" for value in values)
+                  + f" {unit}")
+        if r['errors']:
+            print(f"{r['players']:>8} {'errors':>8} {r['errors']:>9}")
+
+if __name__ == "__main__":
+    main()
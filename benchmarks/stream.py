@@ -0,0 +1,70 @@
+""" net.JSONStream throughput, without a real network
+
+    $ python -m benchmarks.stream
+
+A writer and a reader are connected with trio.testing.memory_stream_pair, so
+this only measures our own overhead (encoding, framing, decoding), for every
+codec, with small messages (keyboard) and big ones (an update with 100
+players). The reader uses read_many, like the server's input loop.
+"""
+
+import time
+import trio
+import trio.testing
+import net
+import wire
+from benchmarks.wire import make_update
+
+MESSAGES = 2000
+
+def make_messages():
+    return {
+        "keyboard": {"type": "keyboard", "state": 3, "seq": 1234},
+        "update": make_update(100),
+    }
+
+async def measure(codec, message, count):
+    a, b = trio.testing.memory_stream_pair()
+    writer = net.JSONStream(a, codec)
+    reader = net.JSONStream(b, codec)
+
+    async def write():
+        for _ in range(count):
+            await writer.write(message)
+
+    async def read():
+        received = 0
+        while received < count:
+            received += len(await reader.read_many())
+
+    start = time.perf_counter()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(write)
+        nursery.start_soon(read)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "messages_per_s": count / elapsed,
+        "mb_per_s": writer.bytes_sent / elapsed / 1e6,
+    }
+
+async def run_async(count):
+    results = []
+    for name, message in make_messages().items():
+        for codec in wire.CODECS.values():
+            result = await measure(codec, message, count)
+            result.update(message=name, codec=codec.name)
+            results.append(result)
+    return results
+
+def run(count=MESSAGES):
+    return trio.run(run_async, count)
+
+def main():
+    print(f"{'message':>10} {'codec':>8} {'messages/s':>12} {'MB/s':>8}")
+    for r in run():
+        print(f"{r['message']:>10} {r['codec']:>8} "
+              f"{r['messages_per_s']:>12.0f} {r['mb_per_s']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+""" Cost of the server's tick, updates and joins against the number of players
+
+    $ python -m benchmarks.tick
+
+- move: moving every player (one tick, no collisions): Player.move for each
+  of them, or PlayerArrays.move with the numpy backend
+- step: Game.step (moving, the spatial index and collisions)
+- send_updates: Game.send_updates, with the clients acking every update (so
+  they get deltas). The outboxes are emptied as if everything was sent.
+- churn: joins and leaves per second through the registry, applied at tick
+  boundaries like the game loop does
+
+Every simulation backend (see SIMULATION_BACKEND) is measured, numpy only if
+it's installed. Nothing touches the network.
+"""
+
+import random
+import time
+import timeit
+import trio
+import wire
+from constants import *
+from fakes import FakeStream, make_server_game
+from server import arrays
+
+PLAYER_COUNTS = 10, 100, 500, 1000, 3000
+BACKENDS = ('python', 'numpy') if arrays.numpy is not None else ('python',)
+KEYBOARD_STATES = 0, UP, RIGHT, DOWN, LEFT, UP | LEFT, DOWN | RIGHT
+
+def make_game(count, backend):
+    game = make_server_game(backend=backend)
+    for i in range(count):
+        join(game, f"player{i}")
+    game.apply_joins_and_leaves()
+    return game
+
+def join(game, username):
+    player = game.new_player(FakeStream(wire.BINARY))
+    player.username = username
+    player.keyboard_state = random.choice(KEYBOARD_STATES)
+    # nobody dies, so that the number of players stays the same
+    player.weak_side = None
+    player.spawn((random.uniform(0, MAP_SIZE[0] - PLAYER_SIZE[0]),
+                  random.uniform(0, MAP_SIZE[1] - PLAYER_SIZE[1])))
+    game.registry.reserve(username)
+    game.registry.join(player)
+    return player
+
+def send_updates(game):
+    game.send_updates()
+    seq = game.snapshots.seq
+    for player in game.registry.snapshot.values():
+        player.outbox._payloads.clear()
+        player.acked_seq = seq
+
+def churn(game, count):
+    """ count players join and then leave """
+    players = [join(game, f"churn{i}") for i in range(count)]
+    game.apply_joins_and_leaves()
+    for player in players:
+        game.registry.leave(player)
+    game.apply_joins_and_leaves()
+
+def per_call_ms(fn, number):
+    return timeit.timeit(fn, number=number) / number * 1000
+
+async def run_async(player_counts, backends, number):
+    results = []
+    dt = 1 / TICK_RATE
+    for backend in backends:
+        for count in player_counts:
+            results.append(measure(backend, count, number, dt))
+    return results
+
+def measure(backend, count, number, dt):
+    game = make_game(count, backend)
+    players = list(game.registry.snapshot.values())
+
+    def move():
+        if game.arrays is not None:
+            game.arrays.move(dt, game.grid.cell_size)
+            return
+        for player in players:
+            player.move(dt)
+
+    churn_count = max(count // 10, 1)
+    start = time.perf_counter()
+    for _ in range(number):
+        churn(game, churn_count)
+    churn_time = time.perf_counter() - start
+
+    return {
+        "backend": backend,
+        "players": count,
+        "move_ms": per_call_ms(move, number),
+        "step_ms": per_call_ms(lambda: game.step(dt), number),
+        # the first update sends everything, the next ones are deltas
+        "send_updates_ms": per_call_ms(lambda: send_updates(game), number),
+        "churn_per_s": 2 * churn_count * number / churn_time,
+    }
+
+def run(player_counts=PLAYER_COUNTS, backends=BACKENDS, number=20):
+    # the registry timestamps joins and leaves with trio's clock
+    return trio.run(run_async, player_counts, backends, number)
+
+def main():
+    print(f"{'backend':>8} {'players':>8} {'move ms':>10} {'step ms':>10} "
+          f"{'updates ms':>11} {'churn/s':>10}")
+    for r in run():
+        print(f"{r['backend']:>8} {r['players']:>8} {r['move_ms']:>10.3f} "
+              f"{r['step_ms']:>10.3f} {r['send_updates_ms']:>11.3f} "
+              f"{r['churn_per_s']:>10.0f}")
+
+if __name__ == "__main__":
+    main()
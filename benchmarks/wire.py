@@ -0,0 +1,60 @@
+""" Compares the codecs from wire on 'update' messages
+
+    $ python -m benchmarks.wire
+
+For every player count, it shows how many bytes an update takes and how long
+it takes to encode and decode it.
+"""
+
+import random
+import timeit
+import wire
+
+PLAYER_COUNTS = 1, 10, 100, 500
+
+def make_update(players_count):
+    return {
+        "type": "update",
+        "tick": 600,
+        "time": 10.0,
+        "seq": 1234,
+        "baseline": 1233,
+        "players": {
+            f"player{i}": {
+                "pos": [random.uniform(0, 500), random.uniform(0, 500)],
+                "input": random.randint(0, 1000),
+            }
+            for i in range(players_count)
+        },
+        "gone_players": [],
+        "new_players": {},
+    }
+
+def measure(codec, update, number):
+    frame = codec.encode(update)
+    encode = timeit.timeit(lambda: codec.encode(update), number=number)
+    decode = timeit.timeit(lambda: codec.decode(frame), number=number)
+    return {
+        "bytes": len(frame),
+        "encode_us": encode / number * 1e6,
+        "decode_us": decode / number * 1e6,
+    }
+
+def run(player_counts=PLAYER_COUNTS, number=200):
+    results = []
+    for count in player_counts:
+        update = make_update(count)
+        for codec in wire.CODECS.values():
+            result = measure(codec, update, number)
+            result.update(codec=codec.name, players=count)
+            results.append(result)
+    return results
+
+def main():
+    print(f"{'players':>8} {'codec':>8} {'bytes':>8} {'encode µs':>10} {'decode µs':>10}")
+    for r in run():
+        print(f"{r['players']:>8} {r['codec']:>8} {r['bytes']:>8} "
+              f"{r['encode_us']:>10.1f} {r['decode_us']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+""" What part of the map is on the screen
+
+The camera follows our player, and the players it doesn't see aren't drawn at
+all (see Player.place), so rendering costs as much with 10 players on the
+screen in a huge map as in a small one.
+"""
+
+import pygame
+from constants import *
+
+class Camera:
+
+    def __init__(self, size=WINDOW_SIZE, world=MAP_SIZE, margin=CULLING_MARGIN):
+        # the part of the world on the screen, in world coordinates
+        self.rect = pygame.Rect((0, 0), size)
+        self.world = pygame.Rect((0, 0), world)
+        self.rect.clamp_ip(self.world)
+        self._culling = self.rect.inflate(2 * margin, 2 * margin)
+
+    def follow(self, pos):
+        """ Centers the camera on pos (world coordinates), without showing
+        what's outside of the map (unless the map is smaller than the
+        screen, then it's centered) """
+        self.rect.center = pos
+        self.rect.clamp_ip(self.world)
+        self._culling.center = self.rect.center
+
+    def sees(self, rect):
+        """ Whether something in rect (world coordinates) might be on the
+        screen. There's a margin, for what's drawn around it (usernames) """
+        return self._culling.colliderect(rect)
+
+    def to_screen(self, rect):
+        return rect.move(-self.rect.left, -self.rect.top)
+
+    def __str__(self):
+        return f"<Camera {self.rect}>"
@@ -5,7 +5,6 @@ import trio
 import pygame
 import pygame.freetype
 import logging
-from collections import namedtuple
 from pygame.locals import *
 from constants import *
 from client.utils import *
@@ -13,23 +12,12 @@ from client.utils import *
 from client.scene import Scene
 from client.game import Game
 from client.username import Username
+from client.resources import Resources
+from client.frames import FrameScheduler
 
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-
-def load_fonts():
-    fonts = namedtuple('Fonts', 'mono')(
-        pygame.freetype.SysFont("Fira Mono", 12)
-    )
-
-    for font in fonts:
-        font.fgcolor = WHITE
-
-    return fonts
-
-MAX_FPS = 60
 
 class SceneManager:
 
@@ -39,7 +27,7 @@ class SceneManager:
     }
 
     def __init__(self, nursery):
-        self.screen = pygame.display.set_mode((640, 400))
+        self.screen = pygame.display.set_mode(WINDOW_SIZE)
         self.srect = self.screen.get_rect()
 
         pygame.display.set_caption("Nine42")
@@ -52,9 +40,15 @@ class SceneManager:
         self.game_nursery = nursery
 
         self.pdata = PersistentData()
-        self.pdata.fonts = load_fonts()
+        self.pdata.resources = Resources()
+        self.pdata.fonts = self.pdata.resources.fonts
 
-        self.clock = pygame.time.Clock()
+        self.frames = FrameScheduler(MAX_FPS)
+
+        # see render_dirty: the whole screen has to be repainted (new scene),
+        # and where the debug infos were drawn
+        self.repaint = True
+        self.debug_rect = None
 
         self.mainloop_running = False
         self.game_nursery.start_soon(self.mainloop)
@@ -62,10 +56,9 @@ class SceneManager:
     def show_debug_infos(self):
         text = f"{self.scene.debug_string()} {self.scene} {round(self.fps):2} fps"
 
-        with fontedit(self.pdata.fonts.mono) as font:
-            rect = font.get_rect(text)
-            rect.bottomright = self.srect.bottomright
-            font.render_to(self.screen, rect, None, bgcolor=BLACK)
+        label = self.pdata.resources.text(text, bgcolor=BLACK)
+        return self.screen.blit(label,
+            label.get_rect(bottomright=self.srect.bottomright))
 
     def run_scene(self):
         """ Runs the current scene, returning the next scene that the current
@@ -87,16 +80,39 @@ class SceneManager:
         if new_scene is not None:
             return new_scene
 
-        self.screen.fill(0)
-        self.scene.render(self.screen, self.srect)
+        if DIRTY_RECTS:
+            changed = self.render_dirty()
+        else:
+            self.screen.fill(0)
+            self.scene.render(self.screen, self.srect)
+            if self.debug:
+                self.show_debug_infos()
+
+        self.fps = self.frames.fps
+
+        if DIRTY_RECTS:
+            pygame.display.update(changed)
+        else:
+            pygame.display.flip()
+
+    def render_dirty(self):
+        """ Only repaints what changed, returns the rects to update on the
+        display """
+        damaged = []
+        if self.repaint:
+            damaged.append(self.srect)
+            self.repaint = False
+        if self.debug_rect is not None:
+            # the debug infos are drawn over the scene
+            damaged.append(self.debug_rect)
+            self.debug_rect = None
+
+        changed = self.scene.render_dirty(self.screen, self.srect, damaged)
 
         if self.debug:
-            self.show_debug_infos()
-
-        self.fps = self.clock.get_fps()
-
-        self.clock.tick(MAX_FPS)
-        pygame.display.flip()
+            self.debug_rect = self.show_debug_infos()
+            changed.append(self.debug_rect)
+        return changed
 
     async def mainloop(self):
         if self.mainloop_running:
@@ -110,6 +126,7 @@ class SceneManager:
             async with trio.open_nursery() as scene_nursery:
 
                 self.scene = self.scenes[new_scene_name](scene_nursery, self.pdata)
+                self.repaint = True
                 new_scene_name = None
 
                 while new_scene_name is None:
@@ -123,7 +140,8 @@ class SceneManager:
                         log.info(f"Closing the {self.scene} forfully")
                         return scene_nursery.cancel_scope.cancel()
 
-                    await trio.sleep(0)
+                    # the network is read while we wait
+                    await self.frames.wait()
 
     def close_scene(self, scene, scene_nursery):
         """ The scene should be ready to be dropped. """
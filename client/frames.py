@@ -0,0 +1,40 @@
+""" Paces the frames of the client without blocking trio
+
+pygame.time.Clock.tick sleeps (it blocks the whole event loop, so nothing
+reads the network while it waits). FrameScheduler.wait sleeps with trio
+instead: the updates from the server are read as soon as they arrive, and are
+ready for the next frame.
+"""
+
+import trio
+from collections import deque
+from constants import *
+
+class FrameScheduler:
+
+    def __init__(self, fps=MAX_FPS, samples=10):
+        self.period = 1 / fps
+        # when the next frame should start
+        self.deadline = None
+        # when the last frames started, to measure the fps
+        self._starts = deque(maxlen=samples)
+
+    async def wait(self):
+        """ Waits for the next frame (it always lets the other tasks run,
+        even when the frame is late) """
+        now = trio.current_time()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period
+        if self.deadline < now:
+            # too late, don't rush the next frames to catch up
+            self.deadline = now
+        await trio.sleep_until(self.deadline)
+        self._starts.append(trio.current_time())
+
+    @property
+    def fps(self):
+        """ The frames per second, measured on the last frames """
+        if len(self._starts) < 2 or self._starts[-1] == self._starts[0]:
+            return 0
+        return (len(self._starts) - 1) / (self._starts[-1] - self._starts[0])
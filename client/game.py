@@ -5,15 +5,22 @@ import time
 import pygame
 import pygame.freetype
 import lockables
+from collections import OrderedDict
 from logging import getLogger
 from pygame.locals import *
+from logs import HotLog
 from constants import *
 from client.utils import *
 from client.scene import Scene
 from client.player import Player
+from client.interpolation import Timeline
+from client.prediction import Predictor
+from client.camera import Camera
+from client.mailbox import Mailbox, merge_updates
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
+# for every update
+hot = HotLog(__name__)
 
 def get_keyboard_state():
     key = pygame.key.get_pressed()
@@ -28,16 +35,29 @@ def get_keyboard_state():
         state |= LEFT
     return state
 
-async def fetch_updates_forever(stream, sendch):
-    """ This'll get more fancy as network will become the bottleneck
-    (it's not yet) """
+async def fetch_updates_forever(stream, mailbox):
+    """ Puts (when it arrived, update) in the mailbox, for every update
+
+    The time is taken as soon as the update is read: by the time the next
+    frame applies it, it would measure how late the frame is too.
+    """
     VALID_STATES = 'update', 'dead'
     while True:
         state = await stream.read()
+        received = trio.current_time()
+        if state['type'] == 'pong':
+            rtt, offset = stream.clock.handle_pong(state)
+            log.debug(f"Clock sync: rtt={rtt * 1000:.1f}ms offset={offset:.4f}s")
+            continue
         if state['type'] not in VALID_STATES:
             raise ValueError(f"Expected type to be one of {VALID_STATES} in {state}")
-        log.debug(f"Update: {state}")
-        await sendch.send(state)
+        hot.debug("Update: %r", state)
+        if state['type'] == 'dead':
+            # the server disconnects us, the username scene connects again
+            await stream.abort()
+            mailbox.put((received, state))
+            return
+        mailbox.put((received, state))
 
 class Game(Scene):
 
@@ -46,60 +66,283 @@ class Game(Scene):
         self.pdata = pdata
 
         self.keyboard_state = 0
-        self.update_sendch, self.update_getch = trio.open_memory_channel(0)
+        # only the latest update, the client never falls behind
+        self.updates = Mailbox(merge=merge_updates)
 
         self.players = {}
 
-        self.lps = 0
+        # the server positions at each snapshot we applied, because updates
+        # only contain what changed since the last snapshot we acked
+        self.snapshots = OrderedDict()
+
+        # the last tick we know the server simulated, and when it was (server
+        # clock, see net.ClockSync)
+        self.tick = 0
+        self.server_time = None
+        self.timeline = Timeline()
+
+        # moves our player without waiting for the server
+        self.predictor = Predictor()
+
+        # the updates come over TCP and UDP, so they can arrive out of order
+        self.last_seq = None
+
+        # net.DatagramStream, once the server answered over UDP
+        self.udp = None
+        # UDP failed, the server was told to use TCP only
+        self.tcp_only = False
+
+        # follows our player, only what it sees is drawn
+        self.camera = Camera()
+
+        # where each player was drawn on the last frame (see render_dirty)
+        self.drawn = {}
 
         self.nursery.start_soon(fetch_updates_forever, self.pdata.stream,
-                                self.update_sendch)
+                                self.updates)
+        self.nursery.start_soon(self.sync_clock_forever)
+        if self.pdata.token is not None:
+            self.nursery.start_soon(self.use_udp)
+
+    async def sync_clock_forever(self):
+        """ The pongs are read by fetch_updates_forever """
+        while True:
+            await self.pdata.stream.ping()
+            await trio.sleep(CLOCK_SYNC_INTERVAL)
+
+    async def use_udp(self):
+        """ Gets the updates over UDP, and sends the inputs there too. Until
+        the server answers, everything goes through TCP """
+        family, type, proto, _, addr = (await trio.socket.getaddrinfo(
+            self.pdata.host, self.pdata.udp_port,
+            trio.socket.AF_INET, trio.socket.SOCK_DGRAM))[0]
+
+        with trio.socket.socket(family, type, proto) as sock:
+            await sock.connect(addr)
+            udp = net.DatagramStream(sock, codec=self.pdata.stream.codec,
+                                     token=bytes.fromhex(self.pdata.token))
+
+            try:
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(self.say_hello_forever, udp)
+                    first = await udp.read()
+                    received = trio.current_time()
+                    nursery.cancel_scope.cancel()
+
+                log.info("Server answered over UDP, using it")
+                self.udp = udp
+                self.updates.put((received, first))
+                await fetch_updates_forever(udp, self.updates)
+            except net.ConnectionClosed:
+                await self.use_tcp_only()
+
+    async def say_hello_forever(self, udp):
+        """ Until the server hears us (datagrams get lost) """
+        while True:
+            try:
+                await udp.write({"type": "hello"})
+            except net.ConnectionClosed:
+                log.debug("Failed to say hello over UDP")
+            await trio.sleep(HELLO_INTERVAL)
+
+    async def send(self, msg):
+        """ Sends an input to the server, over UDP if we can """
+        if self.udp is not None:
+            try:
+                return await self.udp.write(msg)
+            except net.ConnectionClosed:
+                await self.use_tcp_only()
+        await self.pdata.stream.write(msg)
+
+    async def use_tcp_only(self):
+        """ Gives up on UDP, and tells the server so that it sends the updates
+        over TCP too (otherwise it would keep sending them over UDP) """
+        if self.tcp_only:
+            return
+        log.warning("UDP failed, using TCP only")
+        self.tcp_only = True
+        self.udp = None
+        await self.pdata.stream.write({"type": "no_udp"})
 
     def debug_string(self):
-        return f"lps: {self.lps}"
+        text = f"tick: {self.tick} delay: {self.timeline.delay * 1000:.0f}ms"
+        clock = self.pdata.stream.clock
+        if clock.synced:
+            text += f" rtt: {clock.rtt * 1000:.0f}ms"
+        return text
 
     def update(self):
         """ This function is ran every frame """
+        now = trio.current_time()
         new = get_keyboard_state()
         if new != self.keyboard_state:
             self.keyboard_state = new
-            self.nursery.start_soon(self.pdata.stream.write, {
+            self.nursery.start_soon(self.send, {
                 "type": "keyboard",
-                "state": self.keyboard_state
+                "state": self.keyboard_state,
+                "seq": self.predictor.input(self.keyboard_state, now)
             })
 
-        # see if there any fresh updates from the server
-        try:
-            update = self.update_getch.receive_nowait()
-        except trio.WouldBlock:
-            # no updates available, "guess" what should be happening
-            for player in self.players.values():
-                player.update()
-            return
+        # see if there's a fresh update from the server
+        if self.updates:
+            received, update = self.updates.take()
+            if update['type'] == 'dead':
+                log.info("Killed, back to the username scene")
+                self.pdata.dead = True
+                self.close()
+                return 'username'
+            self.apply_update(update, received)
+
+        # render in the past, in between the snapshots we have, except for
+        # our player which is predicted
+        render_time = self.timeline.render_time(now)
+        for username, player in self.players.items():
+            if username == self.pdata.username:
+                player.update(render_time, self.predictor.position(now))
+            else:
+                player.update(render_time)
 
+        me = self.players.get(self.pdata.username)
+        if me is not None:
+            self.camera.follow(me.rect.center)
+        for player in self.players.values():
+            player.place(self.camera)
+
+    def apply_update(self, update, received=None):
+        """ received is when the update arrived, now by default """
         if update['type'] != 'update':
             log.warning(f"Recieved invalid update: {update}")
             return
 
+        if self.last_seq is not None and update['seq'] <= self.last_seq:
+            hot.debug("Discarding old update %d", update['seq'])
+            return
+        self.last_seq = update['seq']
+
         # update state from server
-        self.lps= update['lps']
+        self.tick = update['tick']
+        self.server_time = update['time']
+        if received is None:
+            received = trio.current_time()
+        self.timeline.observe(self.server_time, received)
+
+        # who's in the view is relative to the baseline too: the updates
+        # since then might have been lost
+        if update['baseline'] is None:
+            baseline = {}
+        else:
+            baseline = self.snapshots.get(update['baseline'])
+            if baseline is None:
+                log.warning(f"Unknown baseline {update['baseline']} "
+                            f"in {update}")
+                # the best we can do
+                baseline = {username: player.server_pos
+                            for username, player in self.players.items()}
 
-        for username in update['gone_players']:
+        if update.get('reset'):
+            log.info("Server reset the game state")
+            self.snapshots.clear()
+
+        gone = set(update['gone_players'])
+        visible = (baseline.keys() - gone) | update['new_players'].keys()
+        for username in self.players.keys() - visible:
             del self.players[username]
             log.info(f"Remove player {username}")
 
-        for username, state in update['players'].items():
-            self.players[username].update_state(state['pos'])
-
         for username, state in update['new_players'].items():
+            if username in self.players and username not in gone:
+                # we already had it, from an update that wasn't acked yet
+                continue
             self.players[username] = Player(username, state['pos'],
-                state['color'], self.pdata.fonts)
+                state['color'], self.pdata.resources)
             log.info(f"Add new player {self.players[username]}")
 
+        snapshot = {}
+        for username, player in self.players.items():
+            if username in update['players']:
+                pos = update['players'][username]['pos']
+            elif username in update['new_players']:
+                pos = update['new_players'][username]['pos']
+            elif username in baseline:
+                # didn't change since the baseline
+                pos = baseline[username]
+            else:
+                # joined after the baseline and hasn't moved since
+                pos = player.server_pos
+            player.update_state(self.server_time, pos)
+            snapshot[username] = pos
+
+        me = update['players'].get(self.pdata.username)
+        if me is not None and 'input' in me:
+            self.predictor.reconcile(me['pos'], me['input'],
+                                     self.snapshot_time(update))
+
+        self.snapshots[update['seq']] = snapshot
+        if len(self.snapshots) > SNAPSHOT_HISTORY:
+            self.snapshots.popitem(last=False)
+
+        self.nursery.start_soon(self.send, {
+            "type": "ack",
+            "seq": update['seq']
+        })
+        if self.udp is not None and self.predictor.pending:
+            # the datagram with the last change might have been lost
+            seq, state, sent = self.predictor.inputs[-1]
+            self.nursery.start_soon(self.send, {
+                "type": "keyboard",
+                "state": state,
+                "seq": seq
+            })
+
+    def snapshot_time(self, update):
+        """ When (in our clock) the inputs that made this update were sent """
+        clock = self.pdata.stream.clock
+        if not clock.synced:
+            # the latest it could be
+            return trio.current_time()
+        return clock.local_time(update['time']) - clock.rtt / 2
+
     def render(self, surf, srect):
         for player in self.players.values():
             player.render(surf, srect)
 
+    def render_dirty(self, surf, srect, damaged):
+        # the players the camera doesn't see are like gone
+        bounds = {username: player.bounds()
+                  for username, player in self.players.items()
+                  if player.screen_rect is not None}
+
+        # where the players that moved were, and where they are now
+        dirty = list(damaged)
+        for username, rect in bounds.items():
+            old = self.drawn.get(username)
+            if old != rect:
+                dirty.append(rect)
+                if old is not None:
+                    dirty.append(old)
+        for username in self.drawn.keys() - bounds.keys():
+            dirty.append(self.drawn[username])
+        self.drawn = bounds
+
+        if len(dirty) > MAX_DIRTY_RECTS:
+            # cheaper to repaint everything
+            surf.fill(0)
+            self.render(surf, srect)
+            return [srect]
+
+        dirty = merge_rects(dirty)
+        for rect in dirty:
+            surf.fill(0, rect)
+        # repaint the players in every dirty rect, only there (a player that
+        # didn't move might be on top of one that did)
+        for username, rect in bounds.items():
+            player = self.players[username]
+            for i in rect.collidelistall(dirty):
+                surf.set_clip(dirty[i])
+                player.render(surf, srect)
+        surf.set_clip(None)
+        return dirty
+
     def close(self):
         # brute force
         self.nursery.cancel_scope.cancel()
\ No newline at end of file
@@ -0,0 +1,124 @@
+""" Smooth movement from the server snapshots
+
+The server only sends a snapshot every SERVER_REFRESH_RATE, but we render at
+60 fps. Instead of guessing where the players are going, we render slightly
+in the past (render time = now - delay), where we have a snapshot on both
+sides, and interpolate between them. Since the position is computed from the
+snapshots every frame (instead of moving a bit every frame), it doesn't depend
+on the frame rate and errors don't accumulate.
+
+- Timeline: one for the game. It knows how the server time (the "time" of
+  the updates) maps to ours, and how much delay we need to absorb the jitter.
+- Interpolator: one per player, it buffers its last snapshots.
+
+If a snapshot is late, the players keep moving the same way they were
+(extrapolation) for at most MAX_EXTRAPOLATION seconds, and then they stop.
+"""
+
+from collections import deque
+from constants import *
+
+# the transit times the latency is estimated from
+TRANSIT_SAMPLES = 32
+# how many times the jitter is added to the delay
+JITTER_MARGIN = 2
+# how fast the delay moves towards the delay we want, per second of render
+# time, so that the players don't jump when it changes
+DELAY_ADJUST_RATE = .1
+
+class Timeline:
+
+    def __init__(self, refresh_rate=SERVER_REFRESH_RATE,
+                 max_delay=MAX_INTERPOLATION_DELAY):
+        self.refresh_rate = refresh_rate
+        self.max_delay = max_delay
+
+        # our time - server time, when the updates arrived. It includes the
+        # clock offset and the latency, so the smallest one is the update
+        # that was the least delayed
+        self.transits = deque([], maxlen=TRANSIT_SAMPLES)
+        self._last_transit = None
+        # how much the transit time varies, like RTP (RFC 3550)
+        self.jitter = 0
+
+        self.delay = refresh_rate
+        self._last_render = None
+
+    @property
+    def target_delay(self):
+        """ Enough to always have the next snapshot, even if it's late """
+        return min(self.refresh_rate + JITTER_MARGIN * self.jitter,
+                   self.max_delay)
+
+    def observe(self, server_time, now):
+        """ An update with this server time arrived now """
+        transit = now - server_time
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+        self.transits.append(transit)
+
+    def render_time(self, now):
+        """ The server time to render at now. It never goes backwards """
+        if not self.transits:
+            return None
+
+        server_now = now - min(self.transits)
+
+        if self._last_render is not None:
+            elapsed = max(server_now - self.delay - self._last_render, 0)
+            step = DELAY_ADJUST_RATE * elapsed
+            self.delay += max(min(self.target_delay - self.delay, step), -step)
+
+        render = server_now - self.delay
+        if self._last_render is not None and render < self._last_render:
+            render = self._last_render
+        self._last_render = render
+        return render
+
+class Interpolator:
+
+    def __init__(self, size=INTERPOLATION_BUFFER,
+                 max_extrapolation=MAX_EXTRAPOLATION):
+        # (server time, pos), oldest first
+        self.snapshots = deque([], maxlen=size)
+        self.max_extrapolation = max_extrapolation
+
+    def push(self, time, pos):
+        """ Snapshots older than the last one are ignored """
+        if self.snapshots and time <= self.snapshots[-1][0]:
+            return
+        self.snapshots.append((time, tuple(pos)))
+
+    def position(self, time):
+        """ Where the player was at this (server) time """
+        if not self.snapshots:
+            return None
+
+        first_time, first_pos = self.snapshots[0]
+        if time is None or time <= first_time:
+            return list(first_pos)
+
+        last_time, last_pos = self.snapshots[-1]
+        if time >= last_time:
+            return self._extrapolate(time)
+
+        # the buffer is small, a linear search is fine
+        for (t0, p0), (t1, p1) in zip(self.snapshots,
+                                      list(self.snapshots)[1:]):
+            if t0 <= time <= t1:
+                return lerp(p0, p1, (time - t0) / (t1 - t0))
+
+    def _extrapolate(self, time):
+        last_time, last_pos = self.snapshots[-1]
+        if len(self.snapshots) < 2:
+            return list(last_pos)
+
+        previous_time, previous_pos = self.snapshots[-2]
+        # don't go further than max_extrapolation past the last snapshot
+        ahead = min(time - last_time, self.max_extrapolation)
+        return lerp(previous_pos, last_pos,
+                    1 + ahead / (last_time - previous_time))
+
+def lerp(a, b, t):
+    return [a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t]
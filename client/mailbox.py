@@ -0,0 +1,60 @@
+""" The updates from the server, waiting for the next frame
+
+A channel queues every update: when the client renders slower than the server
+sends (or stalls), it falls further and further behind. The mailbox only
+keeps the latest update: the updates are relative to what the client acked,
+so it doesn't need the ones it missed (see merge_updates), and it always
+renders the current state.
+"""
+
+class Mailbox:
+    """ Holds one value, putting a new one replaces it (or merges them) """
+
+    def __init__(self, merge=None):
+        """ merge(older, newer) returns the value to keep, the newer one by
+        default """
+        self.merge = merge
+        self._value = None
+        self._full = False
+        # values that were replaced before being taken
+        self.replaced = 0
+
+    def put(self, value):
+        """ Never blocks """
+        if self._full:
+            self.replaced += 1
+            if self.merge is not None:
+                value = self.merge(self._value, value)
+        self._value = value
+        self._full = True
+
+    def take(self):
+        """ The value, or None if nothing was put since the last take """
+        value = self._value
+        self._value = None
+        self._full = False
+        return value
+
+    def __bool__(self):
+        return self._full
+
+def merge_updates(older, newer):
+    """ The update to keep when older wasn't applied yet: the newest one
+
+    Both are (when it arrived, update) pairs, see client.game.
+    fetch_updates_forever: the time it arrived (not when it's applied) is
+    what the interpolation needs to measure the jitter.
+
+    Every update is relative to a baseline the client acked (even who's in
+    the view, see server.game.Game.send_updates), so the newer update doesn't
+    need the older one.
+    """
+    older_update, newer_update = older[1], newer[1]
+    if older_update['type'] == 'dead':
+        # nothing matters after that
+        return older
+    if older_update['type'] == newer_update['type'] == 'update' \
+            and newer_update['seq'] <= older_update['seq']:
+        # out of order (UDP), the client would discard it anyway
+        return older
+    return newer
@@ -1,24 +1,20 @@
-import time
 import pygame
 import logging
 from constants import *
 from client.utils import *
+from client.interpolation import Interpolator
 
 log = logging.getLogger(__name__)
 
 DEBUG_SERVER_POSITION = 1 << 0
 DEBUG_NO_PLAYER = 1 << 1
-DEBUG_PREDICTED_POSITION = 1 << 2
 
-DEBUG = DEBUG_SERVER_POSITION | DEBUG_PREDICTED_POSITION
+DEBUG = DEBUG_SERVER_POSITION
 DEBUG = 0
 
-# by how much we predict the position and move to it
-PREDICTION = 0
-
 class Player:
 
-    def __init__(self, username, pos, color, fonts):
+    def __init__(self, username, pos, color, resources):
 
         self.server_pos = pos
         self.pos = list(self.server_pos)
@@ -26,89 +22,75 @@ class Player:
         self.color = color
         self.username = username
 
+        # where the player is, in the world and on the screen (None: the
+        # camera doesn't see it, see place)
         self.rect = pygame.Rect((0, 0), PLAYER_SIZE)
+        self.screen_rect = None
 
-        # the predicted position
-        self.predicted_pos = None
-
-        self.last_server_update = time.time()
-        self.fonts = fonts
-
-    def update_state(self, new_server_pos):
-        """ Update state from the server 
-
-        Rule #1:
-
-        Every time I receive a server update, I make a prediction about where the
-        player will be at the next server update. We assume that the direction
-        of the player between the 2 server updates will be the same in the next
-        update (this will obviously be wrong sometimes, but it will be
-        corrected by rule #2)
-
-        Rule #2:
-
-        Whatever happens, I have to get to the predicted position  exactly on
-        the next server update.
-        """
-
-        self.last_server_update = time.time()
-
-        self.predicted_pos = [
-            new_server_pos[0] + (new_server_pos[0] - self.server_pos[0]) * PREDICTION,
-            new_server_pos[1] + (new_server_pos[1] - self.server_pos[1]) * PREDICTION
-        ]
+        # the last snapshots from the server, to render in between
+        self.interpolator = Interpolator()
+        self.resources = resources
 
+    def update_state(self, server_time, new_server_pos):
+        """ Update state from the server, server_time is the "time" of the
+        update """
+        self.interpolator.push(server_time, new_server_pos)
         self.server_pos = new_server_pos
 
+    def update(self, render_time, predicted=None):
+        """ Update state in between server updates (see client.interpolation)
 
-        # direction = [
-        #     arg(new_server_pos[0] - self.server_pos[0]),
-        #     arg(new_server_pos[1] - self.server_pos[1])
-        # ]
-        # self.last_pos = self.pos
-        # self.server_pos = new_server_pos
-
-        # predicted_change = [
-        #     direction[0] * PLAYER_SPEED * SERVER_REFRESH_RATE,
-        #     direction[1] * PLAYER_SPEED * SERVER_REFRESH_RATE,
-        # ]
-
-        # self.prediction = 
-
-
-    def update(self):
-        """ Update state in between server updates """
-        if self.predicted_pos:
-            percentage_done = (time.time() - self.last_server_update) / SERVER_REFRESH_RATE
-            dx = percentage_done * (self.predicted_pos[0] - self.pos[0])
-            dy = percentage_done * (self.predicted_pos[1] - self.pos[1])
-            self.pos = [self.pos[0] + dx, self.pos[1] + dy]
+        predicted is where the player is right now, if we know better than
+        the server (see client.prediction) """
+        pos = predicted or self.interpolator.position(render_time)
+        if pos is not None:
+            self.pos = pos
 
         self.rect.left = int(round(self.pos[0]))
         self.rect.top = int(round(self.pos[1]))
 
+    def place(self, camera):
+        """ Puts the player on the screen, if the camera sees it """
+        if camera.sees(self.rect):
+            self.screen_rect = camera.to_screen(self.rect)
+        else:
+            self.screen_rect = None
+
+    def server_rect(self):
+        """ Where the server says we are, on the screen """
+        return pygame.Rect(self.server_pos, PLAYER_SIZE).move(
+            self.screen_rect.left - self.rect.left,
+            self.screen_rect.top - self.rect.top)
+
+    def label(self):
+        """ The username, and where it goes """
+        label = self.resources.text(self.username, self.color)
+        rect = label.get_rect(midbottom=self.screen_rect.midtop)
+        rect.top -= 10
+        return label, rect
+
+    def bounds(self):
+        """ Everything render draws on, on the screen """
+        rect = self.screen_rect.union(self.label()[1])
+        if DEBUG & DEBUG_SERVER_POSITION:
+            rect.union_ip(self.server_rect())
+        return rect
+
     def render(self, surf, srect):
         if self.pos is None:
             log.warning(f"{self} position is None")
             return
+        if self.screen_rect is None:
+            # out of the screen
+            return
 
-        with fontedit(self.fonts.mono, fgcolor=self.color) as font:
-            rect = font.get_rect(self.username)
-            rect.midbottom = self.rect.midtop
-            rect.top -= 10
-            font.render_to(surf, rect, self.username)
+        surf.blit(*self.label())
 
         if not DEBUG & DEBUG_NO_PLAYER:
-            pygame.draw.rect(surf, self.color, self.rect)
+            pygame.draw.rect(surf, self.color, self.screen_rect)
 
         if DEBUG & DEBUG_SERVER_POSITION:
-            pygame.draw.rect(surf, self.color,
-                             pygame.Rect(self.server_pos, PLAYER_SIZE), 1)
-
-        if DEBUG & DEBUG_PREDICTED_POSITION and self.predicted_pos:
-            r = pygame.Rect(self.predicted_pos, PLAYER_SIZE)
-            pygame.draw.rect(surf, self.color, r, 1)
-            pygame.draw.rect(surf, self.color, r.inflate(-4, -4), 1)
+            pygame.draw.rect(surf, self.color, self.server_rect(), 1)
 
     def __str__(self):
         return f"<c.Player {self.username!r} {self.pos}>"
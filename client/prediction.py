@@ -0,0 +1,94 @@
+""" Moves the local player straight away, instead of waiting for the server
+
+Every keyboard message has a sequence number, and the server tells us (in
+the "input" of our player in the updates) the last one it applied. When an
+update arrives, we start from the position the server gave us, and replay
+the inputs it hadn't applied yet (reconciliation). So the player moves as
+soon as a key is pressed, and whatever the server decides still wins.
+
+The inputs aren't instantaneous: a key is held for some time. So we remember
+when every input was sent, and the position is the server position plus the
+movement of each input for as long as it was held, from the time the
+snapshot was taken (in our clock) until now.
+"""
+
+import math
+from collections import deque
+from constants import *
+
+# inputs kept if the server never tells us it applied them
+MAX_PENDING_INPUTS = 256
+
+def move(pos, state, dt):
+    """ Same as server.player.Player.move """
+    x, y = pos
+    if state & LEFT:
+        x -= PLAYER_SPEED * dt
+    if state & RIGHT:
+        x += PLAYER_SPEED * dt
+    if state & UP:
+        y -= PLAYER_SPEED * dt
+    if state & DOWN:
+        y += PLAYER_SPEED * dt
+
+    x = min(max(x, 0), MAP_SIZE[0] - PLAYER_SIZE[0])
+    y = min(max(y, 0), MAP_SIZE[1] - PLAYER_SIZE[1])
+    return [x, y]
+
+class Predictor:
+
+    def __init__(self):
+        self.next_seq = 1
+        # (seq, keyboard state, when it was sent), oldest first. The first one
+        # is the last one the server applied.
+        self.inputs = deque([(0, 0, -math.inf)], maxlen=MAX_PENDING_INPUTS)
+
+        # the last position from the server, and when it was (our clock)
+        self.base = None
+        self.base_time = None
+
+    def input(self, state, now):
+        """ Records a new keyboard state, returns its sequence number """
+        seq = self.next_seq
+        self.next_seq += 1
+        self.inputs.append((seq, state, now))
+        return seq
+
+    @property
+    def pending(self):
+        """ The inputs the server hasn't applied yet """
+        return len(self.inputs) - 1
+
+    def reconcile(self, pos, seq, snapshot_time):
+        """ The server says we were at pos at snapshot_time (our clock, it's
+        only an estimate), having applied every input up to seq """
+        if seq < self.inputs[0][0]:
+            # we already know about a more recent one
+            return
+
+        while len(self.inputs) > 1 and self.inputs[1][0] <= seq:
+            self.inputs.popleft()
+
+        # the server was applying inputs[0] when it took the snapshot, so it
+        # was taken after it was sent and before the next one was
+        snapshot_time = max(snapshot_time, self.inputs[0][2])
+        if len(self.inputs) > 1:
+            snapshot_time = min(snapshot_time, self.inputs[1][2])
+
+        self.base = list(pos)
+        self.base_time = snapshot_time
+
+    def position(self, now):
+        """ Where we should be now, None until the server gave us a position """
+        if self.base is None:
+            return None
+
+        pos = self.base
+        time = self.base_time
+        inputs = list(self.inputs)
+        for i, (seq, state, sent) in enumerate(inputs):
+            end = inputs[i + 1][2] if i + 1 < len(inputs) else now
+            if end > time:
+                pos = move(pos, state, end - time)
+                time = end
+        return pos
@@ -0,0 +1,81 @@
+""" Everything the client loads once: fonts, and the text it renders
+
+Rasterizing text is slow (freetype renders every glyph again), and the client
+draws the same strings every frame: the usernames above the players, the
+messages of the scenes. TextCache keeps the surfaces it rendered, so drawing
+a username is only a blit.
+
+    resources = Resources()
+    label = resources.text("hello", color=PINK)
+    screen.blit(label, label.get_rect(center=...))
+"""
+
+import logging
+import pygame
+import pygame.freetype
+from collections import namedtuple, OrderedDict
+from constants import *
+from client.utils import *
+
+log = logging.getLogger(__name__)
+
+Fonts = namedtuple('Fonts', 'mono')
+
+def load_fonts():
+    fonts = Fonts(
+        pygame.freetype.SysFont("Fira Mono", 12)
+    )
+
+    for font in fonts:
+        font.fgcolor = WHITE
+
+    return fonts
+
+class TextCache:
+    """ The surfaces of the text rendered with a font, the least recently
+    used ones are dropped when there are more than `size` """
+
+    def __init__(self, font, size=TEXT_CACHE_SIZE):
+        self.font = font
+        self.size = size
+        # (text, color, size, bgcolor) -> surface
+        self._surfaces = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._surfaces)
+
+    def __call__(self, text, color=WHITE, size=0, bgcolor=None):
+        """ The text rendered on its own surface (size 0: the font's size) """
+        key = (text, _color_key(color), size,
+               None if bgcolor is None else _color_key(bgcolor))
+        try:
+            surface = self._surfaces[key]
+        except KeyError:
+            self.misses += 1
+            surface, _ = self.font.render(text, color, bgcolor, size=size)
+            self._surfaces[key] = surface
+            if len(self._surfaces) > self.size:
+                self._surfaces.popitem(last=False)
+        else:
+            self.hits += 1
+            self._surfaces.move_to_end(key)
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+def _color_key(color):
+    """ pygame.Color and lists can't be keys, and (1, 2, 3) is the same
+    color as Color(1, 2, 3, 255) """
+    return tuple(pygame.Color(color))
+
+class Resources:
+    """ Loaded once, when the client starts (see PersistentData) """
+
+    def __init__(self):
+        self.fonts = load_fonts()
+        self.text = TextCache(self.fonts.mono)
+        log.info(f"Loaded fonts: {', '.join(f.name for f in self.fonts)}")
@@ -19,6 +19,16 @@ class Scene:
            
     def render(self, surf, rect):
         pass
+
+    def render_dirty(self, surf, rect, damaged):
+        """ Repaints what changed since the last frame, and the damaged
+        rects (that something else drew over), and returns the rects that
+        changed on the screen (see SceneManager.run_scene)
+
+        By default, it repaints everything """
+        surf.fill(0)
+        self.render(surf, rect)
+        return [rect]
     
     def update(self):
         pass
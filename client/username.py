@@ -1,6 +1,7 @@
 import logging
 import trio
 import net
+import wire
 import time
 import pygame
 import pygame.freetype
@@ -13,10 +14,12 @@ from client.utils import *
 from lockables import Lockable
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
 
 STATE_CONNECTING = 0, "Connecting to server..."
 STATE_WAITING_INPUT = 10, "Type your username and press enter!"
+STATE_PLAY_AGAIN = STATE_WAITING_INPUT[0], "You were killed! Press enter to play again"
+# the server closes the connection when it refuses, so we connect again
+STATE_REFUSED = STATE_WAITING_INPUT[0], "Refused: {}. Try another username"
 STATE_WAITING = 20, "Waiting for server response..."
 STATE_ACCEPTED = 30, "Going to game!"
 
@@ -25,8 +28,9 @@ async def submit_username(username, stream, sendch):
 
     it sends one value on the channel and then closes it.
 
-    - {"type": "accepted"} if the server accepted
-    - {"type": "refused", "reason": <server message>} if the server refused
+    - {"type": "accepted", "token": <hex>, "udp_port": int} if the server
+      accepted (token and udp_port are None if the server doesn't do UDP)
+    - {"type": "refused", "message": <server message>} if the server refused
     - {"type": "error", "error": <error>} failed to write, read, etc...
     """
 
@@ -34,7 +38,11 @@ async def submit_username(username, stream, sendch):
 
     async with sendch:
         try:
-            await stream.write({"type": "username", "username": username})
+            await stream.write({
+                "type": "username",
+                "username": username,
+                "codecs": PREFERRED_CODECS
+            })
         except net.ConnectionClosed as e:
             return await sendch.send({"type": "error", "error": e})
 
@@ -48,9 +56,15 @@ async def submit_username(username, stream, sendch):
             return await sendch.send({"type": "error", "error": f"invalid response {resp}"})
 
         if resp["type"] == "accepted":
-            return await sendch.send({"type": "accepted"})
+            # everything after this message uses the negotiated codec
+            stream.codec = wire.CODECS[resp.get("codec", "json")]
+            return await sendch.send({
+                "type": "accepted",
+                "token": resp.get("token"),
+                "udp_port": resp.get("udp_port"),
+            })
         elif resp["type"] == "refused":
-            return await sendch.send({"type": "refused", "reason": resp["reason"]})
+            return await sendch.send({"type": "refused", "message": resp.get("message")})
         else:
             return await sendch.send({"type": "error", "error": f"invalid type in {resp}"})
 
@@ -60,8 +74,8 @@ class Username(Scene):
         self.scene_nursery = nursery
         self.pdata = pdata
 
-        self.username = ""
-        self.resp_sendch, self.resp_getch = trio.open_memory_channel(0)
+        # the one from the last game, if we were killed
+        self.username = getattr(pdata, 'username', "")
         self.request_sent = trio.Event()
 
         self.state = STATE_CONNECTING
@@ -70,8 +84,17 @@ class Username(Scene):
 
     async def connect_to_server(self):
         log.debug("Connecting to server...")
-        self.pdata.stream = net.JSONStream(await trio.open_tcp_stream("localhost", PORT))
-        self.state = STATE_WAITING_INPUT
+        old = getattr(self.pdata, 'stream', None)
+        if old is not None:
+            # the last game's, or the one the server refused us on
+            await old.abort()
+        self.pdata.host = "localhost"
+        self.pdata.stream = net.JSONStream(await trio.open_tcp_stream(self.pdata.host, PORT))
+        if getattr(self.pdata, 'dead', False):
+            self.pdata.dead = False
+            self.state = STATE_PLAY_AGAIN
+        else:
+            self.state = STATE_WAITING_INPUT
         log.info(f"Connected to server ({self.state})")
 
     def handle_event(self, e):
@@ -86,22 +109,30 @@ class Username(Scene):
                 self.username = self.username[:-1]
         elif e.key in (K_RETURN, K_KP_ENTER):
 
+            # submit_username closes it once it answered
+            sendch, getch = trio.open_memory_channel(0)
             self.scene_nursery.start_soon(submit_username, self.username,
-                                          self.pdata.stream, self.resp_sendch)
-            self.scene_nursery.start_soon(self.set_state)
+                                          self.pdata.stream, sendch)
+            self.scene_nursery.start_soon(self.set_state, getch)
             self.state = STATE_WAITING
 
         elif e.unicode:
             self.username += e.unicode
 
-    async def set_state(self):
+    async def set_state(self, getch):
         log.debug("Waiting for server response...")
-        resp = await self.resp_getch.receive()
+        resp = await getch.receive()
         log.debug(f"resp: {resp}")
         if resp['type'] == 'accepted':
+            self.pdata.username = self.username
+            self.pdata.token = resp['token']
+            self.pdata.udp_port = resp['udp_port']
             self.state = STATE_ACCEPTED
         elif resp['type'] == 'refused':
-            self.state = STATE_REFUSED
+            self.state = STATE_CONNECTING
+            await self.connect_to_server()
+            code, text = STATE_REFUSED
+            self.state = code, text.format(resp['message'])
         elif resp['type'] == 'error':
             # should display error message and all
             raise ValueError(f"Error during Username scene: {resp}")
@@ -120,14 +151,13 @@ class Username(Scene):
         with fontedit(self.pdata.fonts.mono, origin=True) as font:
             rect = font.render_to(screen, start, self.username)
 
-        if self.state == STATE_WAITING_INPUT:
+        if self.state[0] == STATE_WAITING_INPUT[0]:
             # render the cursor
             start[0] += rect.width
             end = start[0] + 5, start[1]
             pygame.draw.line(screen, WHITE, start, end, 2)
 
-        with fontedit(self.pdata.fonts.mono, fgcolor=GREY) as font:
-            rect = font.get_rect(self.state[1])
-            rect.midbottom = srect.midbottom
-            rect.top -= 20
-            font.render_to(screen, rect, None)
\ No newline at end of file
+        label = self.pdata.resources.text(self.state[1], GREY)
+        rect = label.get_rect(midbottom=srect.midbottom)
+        rect.top -= 20
+        screen.blit(label, rect)
\ No newline at end of file
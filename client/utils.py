@@ -42,5 +42,18 @@ def fontedit(font, **kwargs):
         except AttributeError:
             raise AttributeError(f"Could not reset {key!r} to its original value")
 
+def merge_rects(rects):
+    """ The same area, with the rects that overlap merged together (so
+    that nothing is drawn twice, when drawing in every rect) """
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        i = rect.collidelist(merged)
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
 def classname(obj):
     return obj.__class__.__name__
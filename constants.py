@@ -11,3 +11,38 @@ LEFT = 1 << 3
 
 PLAYER_SPEED = 150 # pixels per second
 SERVER_REFRESH_RATE = .1 # in seconds
+
+TICK_RATE = 60 # simulation ticks per second
+MAX_CATCHUP_TICKS = 5 # max ticks simulated at once when the server lags behind
+SNAPSHOT_HISTORY = 32 # snapshots kept by the server to compute deltas
+PREFERRED_CODECS = 'binary', 'json' # wire formats, in order of preference
+GRID_CELL_SIZE = 50 # size of the cells of the spatial index, in pixels
+VIEW_DISTANCE = 8 # how far the players see, in grid cells (None: everywhere)
+SIMULATION_BACKEND = 'python' # or 'numpy' (needs numpy installed)
+OUTBOX_SIZE = 2 # updates waiting to be sent before a player is considered slow ('drop' and 'disconnect')
+SLOW_PLAYER_POLICY = 'coalesce' # 'coalesce', 'drop' or 'disconnect'
+MAX_MISSED_UPDATES = 50 # updates a slow player can miss in a row ('disconnect')
+WORKERS = 4 # processes running the game in cluster mode
+LOAD_REPORT_INTERVAL = 1 # how often the workers report their load, in seconds
+MAX_DATAGRAM_SIZE = 1200 # bigger messages are sent over TCP instead of UDP
+HELLO_INTERVAL = 1 # how often the client says hello over UDP until it hears back
+CLOCK_SYNC_INTERVAL = 2 # how often the client syncs its clock with the server, in seconds
+CLOCK_SYNC_SAMPLES = 8 # the clock offset comes from the best of these samples
+INTERPOLATION_BUFFER = 8 # server snapshots kept per player by the client
+MAX_INTERPOLATION_DELAY = .5 # the client never renders further in the past, in seconds
+MAX_EXTRAPOLATION = .25 # how long the players keep moving when a snapshot is late
+METRICS_PORT = 9044 # debug HTTP port for the metrics (localhost only, None: off)
+PROFILE_DURATION = 5 # how long the profiler samples on SIGUSR1, in seconds
+PROFILE_INTERVAL = .005 # time between two samples of the profiler, in seconds
+LOG_LEVEL = 'INFO' # on the console, the log file gets everything
+LOG_FILE = 'nine42.log' # None: no log file
+LOG_FILE_SIZE = 10 * 1024 * 1024 # the log file is rotated when it's that big, in bytes
+HOT_LOG_SAMPLING = 100 # only one per-message log out of this many is logged
+INPUT_RATE = 120 # messages per second a client can send before it's throttled
+INPUT_BURST = 60 # messages a client can send at once before it's throttled
+TEXT_CACHE_SIZE = 256 # text surfaces (usernames, messages) the client keeps rendered
+DIRTY_RECTS = True # the client only repaints what changed (False: the whole screen every frame)
+MAX_DIRTY_RECTS = 64 # above this many changed areas, the client repaints the whole screen
+WINDOW_SIZE = 640, 400 # the client's window, in pixels
+CULLING_MARGIN = 100 # the client draws the players that far out of the screen (for the usernames), in pixels
+MAX_FPS = 60 # frames per second the client renders, at most
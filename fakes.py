@@ -0,0 +1,53 @@
+""" Runs the game (server and client) without the network or a window, for
+the tests and the benchmarks
+
+Nothing is started in the background: they call the game logic directly.
+"""
+
+import types
+import net
+import wire
+from constants import *
+from server.game import Game
+
+class FakeNursery:
+    """ Doesn't start anything, only remembers what it was asked to """
+
+    def __init__(self):
+        self.started = []
+
+    def start_soon(self, fn, *args):
+        self.started.append((fn, args))
+
+class FakeStream:
+    """ The stream of a player, remembers what's written to it """
+
+    def __init__(self, codec=wire.JSON):
+        self.codec = codec
+        self.written = []
+
+    async def write(self, obj):
+        self.written.append(obj)
+
+def make_server_game(view_distance=VIEW_DISTANCE, backend=SIMULATION_BACKEND):
+    game = Game(FakeNursery(), port=None, udp_port=None, backend=backend)
+    game.view_distance = view_distance
+    return game
+
+def add_player(game, username, pos, stream=None):
+    """ A player in the game, right away (it doesn't wait for the tick) """
+    player = game.new_player(stream or FakeStream())
+    player.username = username
+    player.spawn(pos)
+    assert game.registry.reserve(username)
+    game.registry.join(player)
+    game.apply_joins_and_leaves()
+    return player
+
+def make_client_game(username='me', resources=None):
+    # only the client needs pygame
+    import client.game
+    pdata = types.SimpleNamespace(
+        username=username, resources=resources, token=None,
+        stream=types.SimpleNamespace(clock=net.ClockSync()))
+    return client.game.Game(FakeNursery(), pdata)
@@ -0,0 +1,73 @@
+""" Logging that doesn't slow the game down
+
+- HotLog: for the logs written for every message or every tick (the hot
+  paths). It uses lazy %-style arguments, so nothing is formatted (no repr
+  of a whole update) unless the message is actually logged, and it only logs
+  one message out of every `every` (sampling). Its logger is the module's
+  logger + '.hot' (net.hot for example), so it can be turned off on its own.
+
+      hot = HotLog(__name__)
+      hot.debug("Read %r", obj)
+
+- setup: logs to the console, and everything (DEBUG) to a file. The file is
+  written by a thread (QueueHandler + QueueListener), so the game loop never
+  waits on the disk.
+"""
+
+import logging
+import logging.handlers
+import queue
+from constants import *
+
+FORMAT = '%(asctime)s %(levelname)-8s %(name)-15s %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class HotLog:
+
+    def __init__(self, name, every=HOT_LOG_SAMPLING):
+        self.logger = logging.getLogger(name + '.hot')
+        self.every = every
+        # messages since the last one that was logged
+        self._skipped = 0
+
+    def _sampled(self):
+        self._skipped += 1
+        if self._skipped < self.every:
+            return False
+        self._skipped = 0
+        return True
+
+    def debug(self, msg, *args):
+        if self.logger.isEnabledFor(logging.DEBUG) and self._sampled():
+            self.logger.debug(msg, *args, stacklevel=2)
+
+    def info(self, msg, *args):
+        if self.logger.isEnabledFor(logging.INFO) and self._sampled():
+            self.logger.info(msg, *args, stacklevel=2)
+
+def setup(level=LOG_LEVEL, file=LOG_FILE):
+    """ Returns the QueueListener that writes the file (None if there's no
+    file), stop it before exiting so that nothing is lost """
+    formatter = logging.Formatter(FORMAT, DATE_FORMAT)
+    root = logging.getLogger()
+
+    console = logging.StreamHandler()
+    console.setLevel(level)
+    console.setFormatter(formatter)
+    root.addHandler(console)
+
+    if file is None:
+        root.setLevel(level)
+        return None
+
+    handler = logging.handlers.RotatingFileHandler(
+        file, maxBytes=LOG_FILE_SIZE, backupCount=1)
+    handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(logging.DEBUG)
+
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    return listener
@@ -1,25 +1,23 @@
 import sys
 import trio
-import logging
-
-logging.basicConfig(
-    format='%(asctime)s %(levelname)-8s %(name)-15s %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    level=logging.DEBUG
-)
-
-if len(sys.argv) != 2:
-    print("Invalid number of arguments")
-    print("Usage: $ python main.py <action> <debug port>")
-    print("where <action> is:")
-    print(" - server")
-    print(" - client")
-    exit(2)
+import logs
 
 def main():
+    if len(sys.argv) != 2:
+        print("Invalid number of arguments")
+        print("Usage: $ python main.py <action> <debug port>")
+        print("where <action> is:")
+        print(" - server")
+        print(" - cluster (server using several processes)")
+        print(" - client")
+        exit(2)
+
     if sys.argv[1] == 'server':
         import server
         trio.run(server.run)
+    elif sys.argv[1] == 'cluster':
+        from server import cluster
+        trio.run(cluster.run)
     elif sys.argv[1] == 'client':
         import client
         trio.run(client.run)
@@ -27,7 +25,13 @@ def main():
         print(f"Invalid command {sys.argv[1]}")
         exit(1)
 
-try:
-    main()
-except KeyboardInterrupt:
-    print("Bye")
\ No newline at end of file
+# the workers of the cluster import this module again (see server/cluster.py)
+if __name__ == "__main__":
+    listener = logs.setup()
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Bye")
+    finally:
+        if listener is not None:
+            listener.stop()
@@ -1,27 +1,167 @@
 import trio
-import json
-import time
+import struct
 from collections import deque
 import logging
+import wire
+from logs import HotLog
 from constants import *
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.INFO)
+# for every message
+hot = HotLog(__name__)
 
 
-# the key used to store timestamps to invalidate packets
+# the key used to store sequence numbers to invalidate packets
 # this could be a per-instance constant, but it will be much easier if
 # everything uses the same key
-TIME_KEY = 't'
+SEQ_KEY = 's'
+
+# the size of the session tokens that identify the clients' datagrams
+TOKEN_SIZE = 16
 
 class ConnectionClosed(Exception):
     pass
 
+class DatagramTooBig(ValueError):
+    """ The message doesn't fit in a datagram, send it over TCP instead """
+
+def encode(obj, codec=wire.JSON):
+    """ Serializes a message so that it's ready to be written.
+
+    Use this when the same message has to be sent to a lot of streams, so it's
+    only serialized once (JSONStream.write accepts bytes as is). The codec has
+    to be the one used by the streams.
+    """
+    if not isinstance(obj, dict):
+        raise ValueError(f"should encode dict, got {obj!r}")
+    return codec.encode(obj)
+
+class ClockSync:
+    """ Estimates the round trip time and the offset of the clock of the other
+    side of a stream, NTP style
+
+    We send a ping with the time we sent it (t0). The other side answers with
+    a pong that has t0, when it received the ping (t1) and when it sent the
+    pong (t2). When we get the pong (t3):
+
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+
+    so that their clock = our clock + offset. The samples with the smallest
+    rtt are the least delayed by queues, so the estimate comes from the best
+    of the last few samples.
+
+    Both clocks are trio.current_time() (monotonic, so the estimate doesn't go
+    wrong when the wall clock jumps).
+    """
+
+    def __init__(self, samples=CLOCK_SYNC_SAMPLES):
+        # (rtt, offset)
+        self.samples = deque([], maxlen=samples)
+        self.rtt = None
+        self.offset = None
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    def ping(self, now=None):
+        """ The message to send to the other side """
+        if now is None:
+            now = trio.current_time()
+        return {'type': 'ping', 't0': now}
+
+    @staticmethod
+    def pong(ping, received, now=None):
+        """ The answer to a ping, received is when it was read """
+        if now is None:
+            now = trio.current_time()
+        return {'type': 'pong', 't0': ping['t0'], 't1': received, 't2': now}
+
+    def handle_pong(self, pong, now=None):
+        """ Adds a sample from a pong, returns its (rtt, offset) """
+        if now is None:
+            now = trio.current_time()
+        t0, t1, t2, t3 = pong['t0'], pong['t1'], pong['t2'], now
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((rtt, offset))
+        self.rtt, self.offset = min(self.samples)
+        return rtt, offset
+
+    def remote_time(self, now=None):
+        """ Converts one of our times into the other side's clock """
+        if not self.synced:
+            raise RuntimeError("clock isn't synced yet")
+        if now is None:
+            now = trio.current_time()
+        return now + self.offset
+
+    def local_time(self, remote):
+        """ Converts a time of the other side into our clock """
+        if not self.synced:
+            raise RuntimeError("clock isn't synced yet")
+        return remote - self.offset
+
+class FrameBuffer:
+    """ Accumulates the bytes received and splits them into frames
+
+    The frames are memoryviews into the buffer, so nothing is copied until the
+    codec decodes them (they have to be released before feeding more data).
+    The consumed bytes are only dropped from the front of the buffer once they
+    take up at least half of it, rather than after every frame, and the buffer
+    remembers where it stopped looking for the end of a frame, so a frame that
+    arrives in lots of small chunks isn't scanned from the start every time.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        # where the next frame starts
+        self._start = 0
+        # there's no end of frame between _start and _scan
+        self._scan = 0
+
+    def __len__(self):
+        return len(self._buf) - self._start
+
+    def feed(self, data):
+        if self._start and self._start * 2 >= len(self._buf):
+            del self._buf[:self._start]
+            self._scan -= self._start
+            self._start = 0
+        self._buf += data
+
+    def take(self):
+        """ Returns (and forgets about) everything that hasn't been consumed """
+        data = bytes(self._buf[self._start:])
+        self._buf.clear()
+        self._start = self._scan = 0
+        return data
+
+    def next_frame(self, codec):
+        """ Returns a memoryview of the next complete frame, or None """
+        end = codec.frame_end(self._buf, self._start, self._scan)
+        if end == -1:
+            self._scan = len(self._buf)
+            return None
+
+        frame = memoryview(self._buf)[self._start:end]
+        self._start = self._scan = end
+        return frame
+
 class JSONStream:
-    """ A wrapper around a trio.Stream """
+    """ A wrapper around a trio.Stream
 
-    def __init__(self, stream):
+    Despite its name, it can use any codec from wire (JSON by default). The
+    codec can be changed at any time (for example once the codec has been
+    negotiated), it applies to the next read/write.
+    """
+
+    def __init__(self, stream, codec=wire.JSON, buffered=b''):
+        """ buffered is what was already received from the stream, but not
+        read yet (see detach) """
         self._stream = stream
+        self.codec = codec
 
         # TODO: use lockable!!
         self._write_semaphore = trio.Semaphore(1)
@@ -29,62 +169,118 @@ class JSONStream:
         # blocks reading from stream and _read_buf at the same time
         self._read_semaphore = trio.Semaphore(1)
 
-        self._read_buf = bytearray()
-
-    async def read(self):
-        async with self._read_semaphore:
-            log.debug(f"Acquired reading semaphore")
-            i = self._read_buf.find(b'\n')
-            while i == -1:
-                try:
-                    data = await self._stream.receive_some(BUFSIZE)
-                except trio.BrokenResourceError:
-                    raise ConnectionClosed("stream closed suddenly while reading")
-
-                if not data:
-                    raise ConnectionClosed("stream closed while reading")
-
-                self._read_buf += data
+        self._read_buf = FrameBuffer()
+        self._read_buf.feed(buffered)
 
-                i = self._read_buf.find(b'\n')
-                log.debug(f"Adding to buffer {data}")
+        # the clock of the other side (see ping and pong)
+        self.clock = ClockSync()
 
-            i += 1
+        # traffic, for stats
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.messages_received = 0
+        self.messages_sent = 0
 
-            line = str(self._read_buf[:i], encoding='utf-8')
-            self._read_buf[:i] = []
+    def detach(self):
+        """ Gives up on the stream, returns it and the bytes that were received
+        but not read yet. Used to hand a stream to someone else """
+        return self._stream, self._read_buf.take()
 
-        log.debug(f"(release read semaphore) Parsing line: {line!r}")
-
-        if line.strip() == "":
-            raise ValueError(f"Invalid empty value: {line!r}")
+    def encode(self, obj):
+        """ Serializes obj with the codec of this stream """
+        return encode(obj, self.codec)
 
+    async def _receive(self):
         try:
-            obj = json.loads(line)
-        except ValueError:
-            log.exception(f"Invalid JSON: {line!r}")
-            raise
+            data = await self._stream.receive_some(BUFSIZE)
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            raise ConnectionClosed("stream closed suddenly while reading")
+
+        if not data:
+            raise ConnectionClosed("stream closed while reading")
+
+        hot.debug("Adding to buffer %r", data)
+        self.bytes_received += len(data)
+        self._read_buf.feed(data)
+
+    def _decode_next(self):
+        """ Decodes the next message in the buffer, None if there isn't any """
+        frame = self._read_buf.next_frame(self.codec)
+        if frame is None:
+            return None
+
+        with frame:
+            try:
+                obj = self.codec.decode(frame)
+            except ValueError:
+                log.exception(f"Invalid {self.codec.name} frame: {bytes(frame)!r}")
+                raise
 
         if not isinstance(obj, dict):
             raise ValueError(f"should be dict, got {type(obj)} in {obj}")
 
-        log.info(f"Read {obj!r}")
+        self.messages_received += 1
+        hot.debug("Read %r", obj)
         return obj
 
-    async def write(self, obj):
-        log.info(f"Sending {obj}")
-        if not isinstance(obj, dict):
-            raise ValueError(f"should send dict, got {obj!r}")
+    async def read(self):
+        async with self._read_semaphore:
+            obj = self._decode_next()
+            while obj is None:
+                await self._receive()
+                obj = self._decode_next()
+        return obj
 
-        await self._write_semaphore.acquire()
-        log.debug(f"Sending {obj}")
-        try:
-            await self._stream.send_all(bytes(json.dumps(obj) + '\n', encoding='utf-8'))
-        except trio.BrokenResourceError:
-            raise ConnectionClosed(f"stream closed while writing")
+    async def read_many(self):
+        """ Reads every message that is available (at least one)
 
-        self._write_semaphore.release()
-        log.debug("Release writing semaphore")
+        Use this instead of read to handle a burst of messages all at once.
+        """
+        async with self._read_semaphore:
+            objs = self._decode_available()
+            while not objs:
+                await self._receive()
+                objs = self._decode_available()
+        return objs
+
+    def _decode_available(self):
+        objs = []
+        obj = self._decode_next()
+        while obj is not None:
+            objs.append(obj)
+            obj = self._decode_next()
+        return objs
+
+    async def write(self, obj):
+        """ Writes a dict, or some bytes that were already encoded (see
+        encode) """
+        hot.debug("Sending %r", obj)
+        if isinstance(obj, bytes):
+            data = obj
+        else:
+            data = self.encode(obj)
+
+        async with self._write_semaphore:
+            try:
+                await self._stream.send_all(data)
+            except (trio.BrokenResourceError, trio.ClosedResourceError):
+                raise ConnectionClosed(f"stream closed while writing")
+            self.bytes_sent += len(data)
+            self.messages_sent += 1
+
+    async def ping(self):
+        """ Starts a clock sync, pass the pong to self.clock.handle_pong """
+        await self.write(self.clock.ping())
+
+    async def pong(self, ping, received):
+        """ Answers a ping, received is when it was read """
+        await self.write(ClockSync.pong(ping, received))
+
+    async def abort(self):
+        """ Closes the stream right away, without waiting for whoever is
+        reading or writing (they get ConnectionClosed) """
+        log.info(f"Aborting stream {self}")
+        await trio.aclose_forcefully(self._stream)
 
     async def aclose(self):
         log.info(f"Closing stream {self}")
@@ -105,9 +301,10 @@ class JSONStream:
 
 class TimedStream(JSONStream):
 
-    """ Time aware JSON stream. It discards old messages. Good any stream based
-    on UDP. If you use TCP, it's very unlikely that you want to use this class.
-    Instead, just use a regular JSONStream.
+    """ Order aware JSON stream. It discards old messages, using a sequence
+    number it adds to every message (SEQ_KEY). If you use TCP, it's very
+    unlikely that you want to use this class. Instead, just use a regular
+    JSONStream. For UDP, see DatagramStream.
 
     I agree this is a very bad name, but I don't have any better ideas right
     now...
@@ -115,37 +312,161 @@ class TimedStream(JSONStream):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._last_timestamp = 0
+        self._last_seq = 0
+        self._next_seq = 1
+
+    def _is_fresh(self, obj):
+        """ Returns False if obj is older than the last message we read """
+        if SEQ_KEY not in obj:
+            raise ValueError(f"no sequence key ({SEQ_KEY!r}) in {obj!r}")
+
+        if obj[SEQ_KEY] <= self._last_seq:
+            log.warning(f"Discarding old message (seq={self._last_seq}) {obj}")
+            return False
+
+        self._last_seq = obj[SEQ_KEY]
+        del obj[SEQ_KEY]
+        return True
 
     async def read(self):
         obj = await super().read()
+        while not self._is_fresh(obj):
+            obj = await super().read()
+        return obj
+
+    async def read_many(self):
+        objs = []
+        while not objs:
+            objs = [obj for obj in await super().read_many()
+                    if self._is_fresh(obj)]
+        return objs
+
+    async def write(self, obj):
+        if isinstance(obj, bytes):
+            raise ValueError("can't number a message that is already encoded")
+
+        if SEQ_KEY in obj:
+            raise ValueError(f"key {SEQ_KEY!r} is reserved in {obj!r}")
+
+        obj[SEQ_KEY] = self._next_seq
+        self._next_seq += 1
+        return await super().write(obj)
 
-        if TIME_KEY not in obj:
-            raise ValueError(f"no time key ({TIME_KEY!r}) in {obj!r}")
+# <sequence number: u64>, after the token
+_DATAGRAM_SEQ = struct.Struct('<Q')
 
-        if obj[TIME_KEY] < self._last_timestamp:
-            log.warning(f"Discarding old message (t={self._last_timestamp}) {obj}")
-            return await self.read()
+class DatagramStream:
+    """ Messages over a trio UDP socket, one frame (of the codec) per datagram
 
-        self._last_timestamp = obj[TIME_KEY]
-        del obj[TIME_KEY]
+    UDP doesn't have head-of-line blocking, but datagrams get lost and arrive
+    out of order. The ones older than the last one we read are discarded,
+    using the sequence number in front of every datagram (which, unlike the
+    one of TimedStream, works for messages that were already encoded).
 
+    A datagram is: <token> <sequence number: u64> <frame>
+
+    The token identifies the client, it's issued by the server during the
+    handshake (over TCP). The server doesn't send any token, so it uses the
+    default (b''). Messages bigger than MAX_DATAGRAM_SIZE aren't sent, write
+    raises DatagramTooBig instead.
+
+    The server only has one socket for every client, so it reads the
+    datagrams itself and gives them to the right stream (see unpack).
+    """
+
+    def __init__(self, sock, peer=None, codec=wire.JSON, token=b''):
+        """ If peer is None, the socket should be connected """
+        self.sock = sock
+        self.peer = peer
+        self.codec = codec
+        self.token = token
+
+        self._next_seq = 1
+        self._last_seq = 0
+
+        # datagrams discarded because they arrived too late
+        self.stale = 0
+
+        # traffic, for stats
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.messages_received = 0
+        self.messages_sent = 0
+
+    def encode(self, obj):
+        return encode(obj, self.codec)
+
+    def unpack(self, datagram):
+        """ Returns the message in the datagram (without the token), or None if
+        it's older than the last one. Raises ValueError if it's invalid """
+        self.bytes_received += len(datagram)
+        if len(datagram) < _DATAGRAM_SEQ.size:
+            raise ValueError(f"datagram too short: {datagram!r}")
+
+        seq, = _DATAGRAM_SEQ.unpack_from(datagram)
+        if seq <= self._last_seq:
+            self.stale += 1
+            hot.debug("Discarding old datagram (%d <= %d)", seq, self._last_seq)
+            return None
+
+        frame = datagram[_DATAGRAM_SEQ.size:]
+        if self.codec.frame_end(frame) != len(frame):
+            raise ValueError(f"datagram isn't exactly one frame: {datagram!r}")
+        obj = self.codec.decode(frame)
+
+        if not isinstance(obj, dict):
+            raise ValueError(f"should be dict, got {type(obj)} in {obj}")
+
+        self._last_seq = seq
+        self.messages_received += 1
         return obj
 
+    async def read(self):
+        """ Reads the next fresh message (the socket has to be connected) """
+        while True:
+            try:
+                datagram = await self.sock.recv(MAX_DATAGRAM_SIZE)
+            except OSError as e:
+                # the peer isn't listening (ICMP port unreachable)
+                raise ConnectionClosed(f"can't read datagrams: {e}")
+
+            try:
+                obj = self.unpack(datagram)
+            except ValueError:
+                log.exception("Invalid datagram")
+                continue
+            if obj is not None:
+                return obj
+
     async def write(self, obj):
-        if TIME_KEY in obj:
-            raise ValueError(f"key {TIME_KEY!r} is reserved in {obj!r}")
+        """ Writes a dict, or some bytes that were already encoded (see
+        encode) """
+        if isinstance(obj, bytes):
+            data = obj
+        else:
+            data = self.encode(obj)
+
+        datagram = b''.join((self.token, _DATAGRAM_SEQ.pack(self._next_seq), data))
+        if len(datagram) > MAX_DATAGRAM_SIZE:
+            raise DatagramTooBig(f"{len(datagram)} bytes is too big for a "
+                                 f"datagram (max {MAX_DATAGRAM_SIZE})")
+        self._next_seq += 1
 
-        obj[TIME_KEY] = time.time()
-        return await super().write(obj)
+        try:
+            if self.peer is None:
+                await self.sock.send(datagram)
+            else:
+                await self.sock.sendto(datagram, self.peer)
+        except OSError as e:
+            raise ConnectionClosed(f"can't send datagrams: {e}")
+        self.bytes_sent += len(datagram)
+        self.messages_sent += 1
 
 if __name__ == "__main__":
-    logging.basicConfig(
-        format='%(asctime)s %(levelname)-8s %(name)-15s %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        level=logging.DEBUG
-    )
-    log.setLevel(logging.DEBUG)
+    import logs
+    logs.setup(logging.DEBUG, file=None)
+    # every message
+    hot.every = 1
 
     async def handler(stream):
         stream = JSONStream(stream)
@@ -1,11 +1,17 @@
 import trio
 from logging import getLogger
 from server.game import Game
+from server import metrics
+from constants import *
 
 log = getLogger(__name__)
 
 async def run():
     log.info("Star server")
     async with trio.open_nursery() as nursery:
-        Game(nursery)
+        game = Game(nursery)
+        metrics.REGISTRY.collector(metrics.game_collector(game))
+        if METRICS_PORT is not None:
+            nursery.start_soon(metrics.serve, METRICS_PORT)
+        nursery.start_soon(metrics.profile_on_signal)
     log.info("Exiting server")
\ No newline at end of file
@@ -0,0 +1,246 @@
+""" An optional backend (SIMULATION_BACKEND = 'numpy') that stores the state of
+every player in numpy arrays (one row per player, its slot), so that the
+movement of all the players is computed with a few vectorized operations
+instead of calling Player.move on every player. Same for the collisions (see
+PlayerArrays.hits): going through the pairs of players one by one costs more
+with numpy than with plain floats.
+
+ArrayPlayer is a regular server.player.Player, except that its position,
+keyboard state, color and weak side are views into the arrays.
+"""
+
+from constants import *
+from server.player import Player
+from server.spatial import _FORWARD_NEIGHBOURS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class PlayerArrays:
+
+    def __init__(self, capacity=64):
+        if numpy is None:
+            raise RuntimeError("the 'numpy' simulation backend needs numpy")
+
+        self.pos = numpy.zeros((capacity, 2), dtype=numpy.float64)
+        self.keyboard = numpy.zeros(capacity, dtype=numpy.uint8)
+        self.color = numpy.zeros((capacity, 3), dtype=numpy.uint8)
+        # -1 if the player can't be killed
+        self.weak_side = numpy.full(capacity, -1, dtype=numpy.int8)
+        self.used = numpy.zeros(capacity, dtype=bool)
+
+        # slot -> player (None if the slot is free)
+        self.players = [None] * capacity
+        self._free = list(reversed(range(capacity)))
+
+        self._max_pos = numpy.array([MAP_SIZE[0] - PLAYER_SIZE[0],
+                                     MAP_SIZE[1] - PLAYER_SIZE[1]],
+                                    dtype=numpy.float64)
+
+    def __len__(self):
+        return len(self.players) - len(self._free)
+
+    def allocate(self, player):
+        """ Returns a free slot for the player """
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self.players[slot] = player
+        self.used[slot] = True
+        return slot
+
+    def free(self, slot):
+        self.pos[slot] = 0
+        self.keyboard[slot] = 0
+        self.color[slot] = 0
+        self.weak_side[slot] = -1
+        self.used[slot] = False
+        self.players[slot] = None
+        self._free.append(slot)
+
+    def _grow(self):
+        """ Doubles the capacity. Players index the arrays every time, so they
+        don't keep views to the old ones """
+        capacity = len(self.players)
+        self.pos = numpy.concatenate([self.pos, numpy.zeros_like(self.pos)])
+        self.keyboard = numpy.concatenate([self.keyboard,
+                                           numpy.zeros_like(self.keyboard)])
+        self.color = numpy.concatenate([self.color, numpy.zeros_like(self.color)])
+        self.weak_side = numpy.concatenate([self.weak_side,
+                                            numpy.full_like(self.weak_side, -1)])
+        self.used = numpy.concatenate([self.used, numpy.zeros_like(self.used)])
+        self.players.extend([None] * capacity)
+        self._free.extend(reversed(range(capacity, capacity * 2)))
+
+    def move(self, dt, cell_size):
+        """ Moves every player according to its keyboard state, without
+        leaving the map (same as Player.move)
+
+        Returns the players that changed grid cell.
+        """
+        keyboard = self.keyboard
+        step = PLAYER_SPEED * dt
+
+        before = self.pos // cell_size
+
+        self.pos[:, 0] += step * ((keyboard & RIGHT != 0).astype(numpy.int8)
+                                  - (keyboard & LEFT != 0))
+        self.pos[:, 1] += step * ((keyboard & DOWN != 0).astype(numpy.int8)
+                                  - (keyboard & UP != 0))
+        numpy.clip(self.pos, 0, self._max_pos, out=self.pos)
+
+        moved = (before != self.pos // cell_size).any(axis=1)
+        return [self.players[slot] for slot in numpy.flatnonzero(moved)
+                if self.players[slot] is not None]
+
+    def hits(self, cell_size):
+        """ The players that got hit on their weak side, as (player, killer)
+        pairs, like the collisions of server.game.Game.check_collisions
+
+        The pairs are found like with server.spatial.Grid (the players in
+        the same cell or in neighbouring ones), but all at once.
+        """
+        slots = numpy.flatnonzero(self.used)
+        pos = self.pos[slots]
+        cells = (pos // cell_size).astype(numpy.int64)
+        # one number per cell. The cells above the map (y == -1) end up
+        # after the last row of the previous column, where nobody is
+        rows = int(cells[:, 1].max(initial=0)) + 2
+        keys = cells[:, 0] * rows + cells[:, 1]
+        order = numpy.argsort(keys, kind='stable')
+        keys = keys[order]
+
+        first, second = [], []
+        for dx, dy in (0, 0), *_FORWARD_NEIGHBOURS:
+            target = keys + dx * rows + dy
+            end = numpy.searchsorted(keys, target, side='right')
+            if dx == dy == 0:
+                # only once per pair in the same cell
+                start = numpy.arange(1, len(keys) + 1)
+            else:
+                start = numpy.searchsorted(keys, target, side='left')
+            counts = numpy.maximum(end - start, 0)
+            i = numpy.repeat(numpy.arange(len(keys)), counts)
+            offsets = numpy.arange(len(i)) - numpy.repeat(
+                numpy.cumsum(counts) - counts, counts)
+            first.append(i)
+            second.append(start[i] + offsets)
+        a = order[numpy.concatenate(first)]
+        b = order[numpy.concatenate(second)]
+
+        # same as Player.collides
+        delta = pos[b] - pos[a]
+        colliding = (numpy.abs(delta) <= PLAYER_SIZE).all(axis=1)
+        a, b, delta = slots[a[colliding]], slots[b[colliding]], delta[colliding]
+
+        # same as Player.side_hit_by, for a hit by b (b is hit on the
+        # opposite side)
+        horizontal = numpy.abs(delta[:, 0]) > numpy.abs(delta[:, 1])
+        side = numpy.where(horizontal,
+                           numpy.where(delta[:, 0] > 0, 1, 3),
+                           numpy.where(delta[:, 1] > 0, 2, 0))
+        opposite = numpy.where(horizontal,
+                               numpy.where(delta[:, 0] < 0, 1, 3),
+                               numpy.where(delta[:, 1] < 0, 2, 0))
+
+        hits = []
+        for victims, killers, sides in (a, b, side), (b, a, opposite):
+            killed = self.weak_side[victims] == sides
+            hits.extend(zip([self.players[slot] for slot in victims[killed]],
+                            [self.players[slot] for slot in killers[killed]]))
+        return hits
+
+class ArrayPlayer(Player):
+    """ A player whose state lives in PlayerArrays. Player.move is useless
+    (PlayerArrays.move moves everybody at once) """
+
+    def __init__(self, arrays, stream):
+        self.arrays = arrays
+        self.slot = None
+        # used until the player has a slot
+        self._keyboard_state = 0
+        self._color = None
+        self._weak_side = None
+        super().__init__(stream)
+
+    @property
+    def pos(self):
+        if self.slot is None:
+            return None
+        return self.arrays.pos[self.slot]
+
+    @pos.setter
+    def pos(self, pos):
+        if pos is None:
+            if self.slot is not None:
+                self._keyboard_state = self.keyboard_state
+                self._color = self.color
+                self._weak_side = self.weak_side
+                self.arrays.free(self.slot)
+                self.slot = None
+            return
+
+        if self.slot is None:
+            self.slot = self.arrays.allocate(self)
+            self.arrays.keyboard[self.slot] = self._keyboard_state
+            self.arrays.color[self.slot] = self._color
+            self.weak_side = self._weak_side
+        self.arrays.pos[self.slot] = pos
+
+    @property
+    def keyboard_state(self):
+        if self.slot is None:
+            return self._keyboard_state
+        return int(self.arrays.keyboard[self.slot])
+
+    @keyboard_state.setter
+    def keyboard_state(self, state):
+        if self.slot is None:
+            self._keyboard_state = state
+        else:
+            # the other bits don't mean anything, and wouldn't fit
+            self.arrays.keyboard[self.slot] = state & (UP | RIGHT | DOWN | LEFT)
+
+    @property
+    def color(self):
+        if self.slot is None:
+            return self._color
+        return self.arrays.color[self.slot].tolist()
+
+    @color.setter
+    def color(self, color):
+        if self.slot is None:
+            self._color = color
+        else:
+            self.arrays.color[self.slot] = color
+
+    @property
+    def weak_side(self):
+        if self.slot is None:
+            return self._weak_side
+        side = int(self.arrays.weak_side[self.slot])
+        return None if side == -1 else side
+
+    @weak_side.setter
+    def weak_side(self, side):
+        if self.slot is None:
+            self._weak_side = side
+        else:
+            self.arrays.weak_side[self.slot] = -1 if side is None else side
+
+    def state_for_initialization(self):
+        return {
+            "pos": self.pos.tolist(),
+            "color": self.color
+        }
+
+    def state_for_update(self):
+        return {
+            "pos": self.pos.tolist(),
+            "input": self.input_seq
+        }
+
+    def snapshot_state(self):
+        return (*self.pos.tolist(), self.input_seq)
@@ -0,0 +1,255 @@
+""" Runs several games (rooms) in their own process, to use more than one core
+
+    $ python main.py cluster
+
+The front end (Supervisor) accepts the connections on PORT and reads the
+username handshake. Then it hands the socket over to the worker that has the
+fewest players, along with the handshake and whatever it received after it.
+Every worker runs its own Game, which doesn't listen on PORT itself.
+
+The workers and the supervisor talk over a unix socket (SOCK_SEQPACKET, so
+every message is a datagram). The supervisor sends the sockets of the new
+players (SCM_RIGHTS), and the workers report their load every
+LOAD_REPORT_INTERVAL. If a worker dies, it's restarted.
+"""
+
+import base64
+import json
+import logging
+import multiprocessing
+import socket
+import array
+import trio
+import net
+import logs
+from server.game import Game
+from server import metrics
+from constants import *
+
+log = logging.getLogger(__name__)
+
+# the biggest message between a worker and the supervisor
+MAX_CONTROL_MESSAGE = 1 << 16
+
+async def send_control(sock, obj, fd=None):
+    data = json.dumps(obj).encode('utf-8')
+    if fd is None:
+        await sock.send(data)
+    else:
+        await sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                     array.array('i', [fd]))])
+
+async def receive_control(sock):
+    """ Returns the message and the file descriptor that came with it (if
+    any). Raises net.ConnectionClosed if the other side is gone """
+    data, ancdata, flags, addr = await sock.recvmsg(
+        MAX_CONTROL_MESSAGE, socket.CMSG_SPACE(array.array('i').itemsize))
+    if not data:
+        raise net.ConnectionClosed("control socket closed")
+
+    fd = None
+    for level, type, cdata in ancdata:
+        if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+            fds = array.array('i')
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+            fd = fds[0]
+    return json.loads(data), fd
+
+def worker_main(index, sock, log_file=LOG_FILE):
+    """ Entry point of the worker processes """
+    listener = logs.setup(file=log_file and f"worker{index}-{log_file}")
+    try:
+        trio.run(run_worker, index, sock)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if listener is not None:
+            listener.stop()
+
+async def run_worker(index, sock):
+    sock = trio.socket.from_stdlib_socket(sock)
+    log.info(f"Worker {index} started")
+
+    # players: the players the worker has right now
+    # adopted: every player the worker was given, so that the supervisor knows
+    # which ones the report takes into account
+    load = {'players': 0, 'adopted': 0}
+
+    async def adopt(game, stream, handshake):
+        try:
+            await game.adopt(stream, handshake)
+        finally:
+            load['players'] -= 1
+
+    async with trio.open_nursery() as nursery:
+        # every worker has its own UDP port
+        game = Game(nursery, port=None, udp_port=0)
+        nursery.start_soon(report_load_forever, game, sock, load)
+
+        metrics.REGISTRY.collector(metrics.game_collector(game))
+        if METRICS_PORT is not None:
+            # the supervisor doesn't have any, the worker n is on
+            # METRICS_PORT + n
+            nursery.start_soon(metrics.serve, METRICS_PORT + index)
+        nursery.start_soon(metrics.profile_on_signal)
+
+        while True:
+            try:
+                msg, fd = await receive_control(sock)
+            except net.ConnectionClosed:
+                log.info(f"Worker {index}: supervisor is gone, exiting")
+                nursery.cancel_scope.cancel()
+                return
+
+            if fd is None:
+                log.warning(f"Worker {index}: no socket in {msg}")
+                continue
+
+            # counted right away, so that a report never has the player
+            # neither pending (adopted) nor in the game (players)
+            load['adopted'] += 1
+            load['players'] += 1
+            client = trio.socket.from_stdlib_socket(socket.socket(fileno=fd))
+            stream = net.JSONStream(trio.SocketStream(client),
+                buffered=base64.b64decode(msg['buffered']))
+            nursery.start_soon(adopt, game, stream, msg['handshake'])
+
+async def report_load_forever(game, sock, load):
+    while True:
+        await send_control(sock, {
+            'type': 'load',
+            'players': load['players'],
+            'adopted': load['adopted'],
+            'lps': game.lps,
+            'dropped_ticks': game.ticker.dropped,
+        })
+        await trio.sleep(LOAD_REPORT_INTERVAL)
+
+class Worker:
+
+    def __init__(self, index, process, sock):
+        self.index = index
+        self.process = process
+        self.sock = sock
+
+        # the last report of the worker
+        self.report = {}
+        # players given to the worker (the ones it hasn't reported about yet
+        # count towards its load)
+        self.handed_over = 0
+
+    @property
+    def load(self):
+        pending = self.handed_over - self.report.get('adopted', 0)
+        return self.report.get('players', 0) + pending
+
+    def __str__(self):
+        return f"<Worker {self.index} pid={self.process.pid} load={self.load}>"
+
+class Supervisor:
+
+    def __init__(self, workers_count=WORKERS, log_file=LOG_FILE):
+        self.workers_count = workers_count
+        # every worker logs to its own file (see logs.setup)
+        self.log_file = log_file
+        # index -> Worker, only the ones that are running
+        self.workers = {}
+        self._context = multiprocessing.get_context('spawn')
+
+    def loads(self):
+        """ Players per worker """
+        return {index: worker.load for index, worker in self.workers.items()}
+
+    async def run(self, port=PORT, task_status=trio.TASK_STATUS_IGNORED):
+        async with trio.open_nursery() as nursery:
+            for index in range(self.workers_count):
+                await nursery.start(self.supervise, index)
+            listeners = await nursery.start(trio.serve_tcp, self.accept, port)
+            log.info(f"Supervising {self.workers_count} workers")
+            task_status.started(listeners)
+
+    async def supervise(self, index, task_status=trio.TASK_STATUS_IGNORED):
+        """ Starts the worker, reads its reports, and restarts it if it dies """
+        while True:
+            parent, child = socket.socketpair(socket.AF_UNIX,
+                                              socket.SOCK_SEQPACKET)
+            process = self._context.Process(target=worker_main,
+                args=(index, child, self.log_file), daemon=True)
+            process.start()
+            child.close()
+
+            worker = Worker(index, process, trio.socket.from_stdlib_socket(parent))
+            self.workers[index] = worker
+            task_status.started()
+            task_status = trio.TASK_STATUS_IGNORED
+
+            try:
+                await self.read_reports(worker)
+            finally:
+                self.forget(worker)
+
+            await trio.to_thread.run_sync(process.join)
+            log.error(f"{worker} died (exit code {process.exitcode}), "
+                      "restarting it")
+            await trio.sleep(1)
+
+    async def read_reports(self, worker):
+        while True:
+            try:
+                msg, fd = await receive_control(worker.sock)
+            except (net.ConnectionClosed, OSError, trio.ClosedResourceError):
+                return
+            if msg.get('type') == 'load':
+                worker.report = msg
+                log.debug(f"{worker} reported {msg}")
+
+    def pick_worker(self):
+        """ The worker with the fewest players """
+        if not self.workers:
+            return None
+        return min(self.workers.values(), key=lambda worker: worker.load)
+
+    async def accept(self, stream):
+        """ Reads the handshake and hands the stream over to a worker """
+        jstream = net.JSONStream(stream)
+        try:
+            handshake = await jstream.read()
+        except (net.ConnectionClosed, ValueError):
+            log.info("Connection closed before the handshake")
+            return
+
+        stream, buffered = jstream.detach()
+        while True:
+            worker = self.pick_worker()
+            if worker is None:
+                log.error("No worker available")
+                await jstream.write({'type': 'refused',
+                                     'message': "server unavailable"})
+                return
+
+            try:
+                await send_control(worker.sock, {
+                    'handshake': handshake,
+                    'buffered': base64.b64encode(buffered).decode('ascii'),
+                }, fd=stream.socket.fileno())
+            except (OSError, trio.BrokenResourceError,
+                    trio.ClosedResourceError) as e:
+                log.error(f"Failed to hand a player over to {worker}: {e}")
+                self.forget(worker)
+                continue
+
+            worker.handed_over += 1
+            log.info(f"Handed {handshake.get('username')!r} over to {worker}")
+            # the worker has its own copy of the socket now, trio closes ours
+            return
+
+    def forget(self, worker):
+        """ Stops giving players to a worker we can't talk to. Closing the
+        socket stops the worker too, and then supervise restarts it """
+        if self.workers.get(worker.index) is worker:
+            del self.workers[worker.index]
+        worker.sock.close()
+
+async def run():
+    log.info("Start cluster")
+    await Supervisor(WORKERS).run(PORT)
@@ -1,67 +1,253 @@
-import itertools
+import functools
 import logging
 import trio
-import time
 import random
+import secrets
 import net
-import lockables
+import wire
 from server.player import Player
+from server.ticker import Ticker
+from server.registry import Registry
+from server.snapshots import SnapshotHistory
+from server.spatial import Grid
+from server.arrays import PlayerArrays, ArrayPlayer
+from server import metrics
 from collections import deque
+from logs import HotLog
 from constants import *
 
 log = logging.getLogger(__name__)
-log.setLevel(logging.DEBUG)
-
-def read_available(getch):
-    """ Read all the available items from a channel"""
-    while True:
-        try:
-            yield getch.receive_nowait()
-        except trio.WouldBlock:
-            return
+# for every tick, or every player on every update
+hot = HotLog(__name__)
 
 class Game:
 
-    def __init__(self, nursery):
-        self.players = lockables.Lockable({})
+    def __init__(self, nursery, port=PORT, udp_port=PORT,
+                 backend=SIMULATION_BACKEND):
+        """ If port is None, it doesn't accept players itself, they have to
+        be given to it (see adopt). If udp_port is None, everything goes
+        through TCP """
+        self.registry = Registry()
+
+        # token -> player, to know who sent a datagram
+        self.sessions = {}
+        # the UDP socket, once it's bound
+        self.udp = None
+
+        self.ticker = Ticker(TICK_RATE, MAX_CATCHUP_TICKS)
+        self.snapshots = SnapshotHistory(SNAPSHOT_HISTORY)
+        self.grid = Grid(GRID_CELL_SIZE)
+
+        # how far (in grid cells) the players can see. None means everywhere
+        self.view_distance = VIEW_DISTANCE
+
+        self.slow_player_policy = SLOW_PLAYER_POLICY
+
+        if backend == 'numpy':
+            self.arrays = PlayerArrays()
+            self.new_player = functools.partial(ArrayPlayer, self.arrays)
+        elif backend == 'python':
+            self.arrays = None
+            self.new_player = Player
+        else:
+            raise ValueError(f"Unknown simulation backend {backend!r}")
 
         self.loops_times = deque([], maxlen=10)
         self.lps = 0
 
-        self.last_update = 0
+        # broadcasts that started later than they should have
+        self.late_updates = 0
 
         self.nursery = nursery
 
-        self.nursery.start_soon(trio.serve_tcp, self.accept_players, PORT)
+        if port is not None:
+            self.nursery.start_soon(trio.serve_tcp, self.accept_players, port)
+        if udp_port is not None:
+            self.nursery.start_soon(self.serve_udp, udp_port)
         self.nursery.start_soon(self.gameloop)
-
-        self.notif_sendch, self.notif_getch = trio.open_memory_channel(0)
+        self.nursery.start_soon(self.broadcastloop)
 
     async def gameloop(self):
-        """ The game loop that checks collisions and stuff """
+        """ The game loop that checks collisions and stuff
+
+        It runs at a fixed rate (TICK_RATE), so that the simulation doesn't
+        depend on how long a loop takes. If we fall behind, a few catch up
+        ticks are ran (at most MAX_CATCHUP_TICKS), the rest is dropped.
+        """
         log.info("Start game loop")
 
-        last = time.time()
+        self.ticker.start(trio.current_time())
+        last = trio.current_time()
         while True:
-            async with self.players.cap_lim:
-                for player in self.players.value.values():
-                    # gives how long the last loop took, to move accordingly
-                    player.move(self.loops_times[-1])
+            await trio.sleep_until(self.ticker.next_deadline())
+
+            overruns, dropped = self.ticker.overruns, self.ticker.dropped
+            ticks = self.ticker.advance(trio.current_time())
+            if self.ticker.dropped != dropped:
+                log.warning(f"Game loop is lagging behind, dropped "
+                            f"{self.ticker.dropped - dropped} ticks "
+                            f"({self.ticker.dropped} in total)")
+            elif self.ticker.overruns != overruns:
+                hot.debug("Ran %d ticks to catch up", ticks)
+
+            if ticks:
+                metrics.TICKS_PER_LOOP.observe(ticks)
+            for _ in range(ticks):
+                self.apply_joins_and_leaves()
+                self.step(self.ticker.dt)
+            # for the players killed during the ticks
+            self.registry.publish()
+
+            now = trio.current_time()
+            self.loops_times.append(now - last)
+            last = now
+            self.lps = int(round(len(self.loops_times) / sum(self.loops_times)))
+
+    def apply_joins_and_leaves(self):
+        """ Called at the beginning of every tick """
+        with metrics.PHASES['joins'].time():
+            joined, removed = self.registry.apply()
+            for player in joined:
+                log.debug(f"Add new player: {player}")
+                self.grid.insert(player)
+            for player in removed:
+                log.debug(f"Remove player: {player}")
+                if player in self.grid:
+                    self.grid.remove(player)
+                player.despawn()
+            self.registry.publish()
+
+    def step(self, dt):
+        """ Simulate one tick of dt seconds """
+        with metrics.PHASES['move'].time():
+            if self.arrays is None:
+                for player in self.registry.snapshot.values():
+                    player.move(dt)
+                    self.grid.update(player)
+            else:
+                for player in self.arrays.move(dt, self.grid.cell_size):
+                    # players that haven't been added to the game yet aren't
+                    # in the grid
+                    if player in self.grid:
+                        self.grid.update(player)
+
+        with metrics.PHASES['collisions'].time():
+            self.check_collisions()
+
+    def check_collisions(self):
+        """ Kills the players that got hit on their weak side """
+        if self.arrays is None:
+            hits = self.hits()
+        else:
+            # players that haven't been added to the game yet are in the
+            # arrays too
+            hits = [(player, killer)
+                    for player, killer in self.arrays.hits(self.grid.cell_size)
+                    if player in self.grid and killer in self.grid]
+        dead = dict(hits)
+
+        for player, killer in dead.items():
+            log.info(f"{player} killed by {killer}")
+            if self.registry.remove(player):
+                self.registry.release(player)
+                self.grid.remove(player)
+                player.despawn()
+                self.nursery.start_soon(self.notify_killed, player)
+
+    def hits(self):
+        """ The players that got hit on their weak side, as (player, killer)
+        pairs """
+        for player, other in self.grid.candidate_pairs():
+            if not player.collides(other):
+                continue
+            if player.is_hit_on_weak_side(other):
+                yield player, other
+            if other.is_hit_on_weak_side(player):
+                yield other, player
+
+    async def notify_killed(self, player):
+        """ Tells the player it's dead, and disconnects it (its username was
+        already freed, see Registry.release) """
+        try:
+            await player.killed()
+        except net.ConnectionClosed:
+            log.info(f"{player} left before knowing it was killed")
+        player.outbox.close()
 
-            await self.send_updates()
+    async def broadcastloop(self):
+        """ Sends updates every SERVER_REFRESH_RATE, independently of the
+        simulation rate """
+        next_update = trio.current_time()
+        while True:
+            self.send_updates()
+
+            next_update += SERVER_REFRESH_RATE
+            now = trio.current_time()
+            if next_update < now:
+                # don't try to send the updates we missed, it's pointless
+                self.late_updates += 1
+                next_update = now
+            await trio.sleep_until(next_update)
+
+    async def serve_udp(self, port):
+        """ Receives the datagrams of every player (see net.DatagramStream)
+
+        The updates and the inputs go through UDP, so that a lost packet
+        doesn't hold back the next ones (TCP's head-of-line blocking). The
+        client says hello over UDP with the token it got in the handshake, and
+        from then on its updates are sent there. Everything else stays on TCP.
+        """
+        sock = trio.socket.socket(trio.socket.AF_INET, trio.socket.SOCK_DGRAM)
+        with sock:
+            await sock.bind(('', port))
+            self.udp = sock
+            log.info(f"Listening for datagrams on {self.udp.getsockname()}")
+            while True:
+                try:
+                    datagram, addr = await self.udp.recvfrom(MAX_DATAGRAM_SIZE)
+                except OSError as e:
+                    # ICMP errors from a client that went away
+                    log.debug(f"Error receiving datagram: {e}")
+                    continue
+                self.handle_datagram(datagram, addr)
+
+    def handle_datagram(self, datagram, addr):
+        player = self.sessions.get(datagram[:net.TOKEN_SIZE])
+        if player is None:
+            hot.debug("Datagram with an unknown token from %s", addr)
+            return
 
-            # TODO: adjust time based on performances
-            await trio.sleep(.01)
-            self.loops_times.append(time.time() - last)
-            last = time.time()
-            self.lps = int(round(sum(self.loops_times) / len(self.loops_times) * 1000))
+        if player.tcp_only:
+            # late datagrams, from before the client gave up on UDP
+            hot.debug("Ignoring a datagram from %s, it uses TCP only", player)
+            return
+
+        if player.udp is None:
+            log.info(f"{player} switched to UDP ({addr})")
+            player.udp = net.DatagramStream(self.udp, addr,
+                                            codec=player.stream.codec)
+        # the address might change (NAT)
+        player.udp.peer = addr
+
+        if not player.input_limit.take(trio.current_time()):
+            # flooding (the inputs are sent again with the next ack anyway)
+            player.inputs_dropped += 1
+            hot.info("%s sent too many datagrams, dropped one", player)
+            return
+
+        try:
+            msg = player.udp.unpack(datagram[net.TOKEN_SIZE:])
+            if msg is not None and msg['type'] != 'hello':
+                player.handle_input(msg)
+        except (KeyError, ValueError):
+            log.exception(f"Invalid datagram from {player}")
 
     async def accept_players(self, stream):
-        """ Accepts players and puts them into self.players once
+        """ Accepts players and puts them into the registry once
         they are ready for the game loop """
         log.info("New connection")
 
-        player = Player(net.JSONStream(stream))
+        player = self.new_player(net.JSONStream(stream))
 
         try:
             log.debug("Waiting for player name")
@@ -73,6 +259,18 @@ class Game:
         else:
             await self.initiate_player(player)
 
+    async def adopt(self, stream, handshake):
+        """ Takes care of a player whose username handshake was already read
+        by someone else (see server.cluster) """
+        player = self.new_player(stream)
+        try:
+            player.set_username(handshake)
+        except (KeyError, ValueError):
+            log.exception(f"Invalid handshake {handshake}")
+            await stream.aclose()
+        else:
+            await self.initiate_player(player)
+
     async def initiate_player(self, player):
         log.info(f"Initiating new player {player}")
         player.spawn((
@@ -80,118 +278,210 @@ class Game:
             random.randint(0, MAP_SIZE[1] - PLAYER_SIZE[1]),
         ))
 
-        async with self.players.cap_lim:
-
-            # make sure there aren't duplicate username
-            if player.username in self.players.value:
-                log.warning(f"Duplicate username: {player.username!r}")
-                await player.stream.write({'type': 'refused',
-                                           'message': "used username"})
-                await player.stream.aclose()
-                return
-
-        await player.stream.write({'type': 'accepted'})
-
-        log.info(f"Notification 'new_player' {player}")
-        await self.notif_sendch.send({
-            'type': 'new_player',
-            'player': player
-        })
+        # make sure there aren't duplicate username
+        if not self.registry.reserve(player.username):
+            log.warning(f"Duplicate username: {player.username!r}")
+            player.despawn()
+            await player.stream.write({'type': 'refused',
+                                       'message': "used username"})
+            await player.stream.aclose()
+            return
 
         try:
-            await player.get_user_input_forever()
+            codec = wire.negotiate(player.codecs)
+            accepted = {'type': 'accepted', 'codec': codec.name}
+            if self.udp is not None:
+                player.token = secrets.token_bytes(net.TOKEN_SIZE)
+                self.sessions[player.token] = player
+                accepted['token'] = player.token.hex()
+                accepted['udp_port'] = self.udp.getsockname()[1]
+            await player.stream.write(accepted)
+            player.stream.codec = codec
+
+            log.info(f"Player joined {player}")
+            self.registry.join(player)
+
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(player.outbox.send_forever)
+                await player.get_user_input_forever()
         except net.ConnectionClosed:
-            log.info(f"Notification 'gone_players' {player}")
-            await self.notif_sendch.send({
-                'type': 'gone_players',
-                'player': player
-            })
+            log.info(f"Player left {player}")
+        finally:
+            self.sessions.pop(player.token, None)
+            self.registry.leave(player)
 
-    async def send_updates(self):
+    def send_updates(self):
         """Send updates to the players about the game state
 
-        We can't send data for every frame. Therefore, we only send out every
-        SERVER_REFRESH_RATE second.
+        We can't send data for every tick. Therefore, this is only called every
+        SERVER_REFRESH_RATE second (see broadcastloop)
 
         An update looks like this:
 
         {
-            # the loops per second that the server makes. It is used to sync
-            # the server and the client. It should use absolute time though.
-            # (todo)
-            "lps": int,
+            # the last simulated tick, and the time the simulation is at
+            # (server clock, see net.ClockSync to convert it). The clients
+            # interpolate against these.
+            "tick": int,
+            "time": float,
+            # the sequence number of this snapshot, to be acked by the client
+            "seq": int,
+            # the snapshot (that the client acked) the update is relative to.
+            # If it's None, "new_players" has every player.
+            "baseline": int or None,
+            # only the players that changed since the baseline
             "players": { username: player.state_for_update(), ...}
+            # the players that got in and out of the view since the baseline
             "new_players": { username: player.state_for_initialization(), ...},
-            "gone_players": [ player.username, ...]
+            "gone_players": [ player.username, ...],
+            # only there if the client should forget about every player first
+            # (there's no baseline)
+            "reset": True
         }
 
-        """
-
-        if time.time() - self.last_update < SERVER_REFRESH_RATE:
-            # normally, we would just "return"
-            # but have await trio.sleep(0) guarantees that this function is
-            # always a checkpoint, no matter when it is called
-            return await trio.sleep(0)
+        The updates are only put in the outboxes of the players, it never
+        waits for them to be sent.
 
-        self.last_update = time.time()
+        Every player only hears about the players around it (see view_of).
+        The players that get in its view are sent as "new_players", the ones
+        that leave its view (or the game) as "gone_players", and the ones that
+        stay in its view are sent as "players" if they changed. A player that
+        just joined has an empty view, so it gets everything as "new_players".
 
-        # this part is a bit tricky
-        # To the new players, it sends every existing player and new player as a
-        # "new_players", and doesn't say anything about the player that left.
-        # To the existing player, it sends new players as "new_player", existing
-        # players as "players" and gone players as "gone_players"
-
-        new_players = []
-        gone_players = []
-        for notif in read_available(self.notif_getch):
-            if notif['type'] == 'new_player':
-                new_players.append(notif['player'])
-            elif notif['type'] == 'gone_players':
-                gone_players.append(notif['player'])
-
-        async with self.players.cap_lim:
+        Everything is relative to the baseline, including who's in the view,
+        so the client only needs the baseline and the latest update: the
+        updates in between can be lost or arrive out of order (UDP).
+        """
 
-            # remove the gone_players
-            for player in gone_players:
-                log.debug(f"Remove player: {player}")
-                del self.players.value[player.username]
-
-            new_player_update = {
-                "type": "update",
-                "lps": self.lps,
-                "players": {},
-                "gone_players": {},
-                "new_players": {
-                    p.username: p.state_for_initialization()
-                    for p in itertools.chain(new_players,
-                                             self.players.value.values())
-                }
+        players = self.registry.snapshot
+        with metrics.PHASES['snapshot'].time():
+            snapshot = {
+                username: player.snapshot_state()
+                for username, player in players.items()
             }
-
-            existing_player_update = {
-                "type": "update",
-                "lps": self.lps,
-                "players": {
-                    p.username: p.state_for_update()
-                    for p in self.players.value.values()
-                },
-                "gone_players": [p.username for p in gone_players],
-                "new_players": {
-                    p.username: p.state_for_initialization()
-                    for p in new_players
-                }
+            seq = self.snapshots.record(snapshot)
+
+        # players usually share their views, and their baseline, so they
+        # can share the same update. Every distinct update is only
+        # serialized once (per codec), no matter how many players it's
+        # sent to
+        views = {}
+        changes = {}
+        payloads = {}
+
+        for player in players.values():
+            if player.outbox.full() or (player.outbox and
+                    self.slow_player_policy == 'coalesce'):
+                player.missed_updates += 1
+                if not self.handle_slow_player(player):
+                    continue
+            else:
+                player.missed_updates = 0
+
+            visible = self.view_of(player, views)
+
+            known = player.acked_view()
+            if known is None:
+                changed = None
+            else:
+                if player.acked_seq not in changes:
+                    changes[player.acked_seq] = self.snapshots.delta(
+                        player.acked_seq, snapshot)
+                changed = changes[player.acked_seq]
+            if changed is None:
+                # lost (or never had) the baseline, send everything
+                baseline = None
+                known = frozenset()
+            else:
+                baseline = player.acked_seq
+
+            codec = player.stream.codec
+            key = known, visible, baseline, codec.name
+            if key not in payloads:
+                with metrics.PHASES['serialize'].time():
+                    payloads[key] = net.encode(self.make_update(
+                        seq, baseline, known, visible, changed), codec)
+                metrics.UPDATE_BYTES.observe(len(payloads[key]))
+
+            player.sent_view(seq, visible)
+            metrics.OUTBOX_DEPTH.observe(len(player.outbox))
+            player.outbox.put(payloads[key])
+
+    def handle_slow_player(self, player):
+        """ Called when a player still has updates waiting to be sent
+        (SLOW_PLAYER_POLICY):
+
+        - 'coalesce': as soon as one update is waiting, drops it and sends
+          the new one instead (returns True). It's relative to what the
+          client acked (who's in the view too), so the client doesn't need
+          the dropped ones. Nothing stale is ever sent
+        - 'drop': once the outbox is full, doesn't send the new update, the
+          player will catch up
+        - 'disconnect': same as drop, but disconnect the player once it missed
+          MAX_MISSED_UPDATES updates in a row
+        """
+        if self.slow_player_policy == 'coalesce':
+            hot.debug("%s is too slow, dropping %d updates", player,
+                      len(player.outbox))
+            player.outbox.clear()
+            return True
+
+        if self.slow_player_policy == 'disconnect' \
+                and player.missed_updates > MAX_MISSED_UPDATES:
+            if not player.outbox.closed:
+                log.warning(f"{player} missed {player.missed_updates} "
+                            "updates, disconnecting")
+                player.outbox.close()
+            return False
+
+        player.outbox.dropped += 1
+        return False
+
+    def view_of(self, player, views):
+        """ The players that player can see (itself included)
+
+        That's every player in the cells at most VIEW_DISTANCE cells away from
+        its own, or everybody if VIEW_DISTANCE is None. Views are cached in
+        views, because the players in the same cell have the same view.
+        """
+        if self.view_distance is None:
+            cell = None
+        else:
+            cell = self.grid.cell(player.pos)
+
+        if cell not in views:
+            if cell is None:
+                views[cell] = frozenset(self.registry.snapshot.values())
+            else:
+                views[cell] = frozenset(self.grid.near(cell, self.view_distance))
+        return views[cell]
+
+    def make_update(self, seq, baseline, known, visible, changed):
+        """ Builds the update for a player that knows about the players in
+        known (as of the baseline) and should now see the players in visible.
+        changed is what changed since the baseline (None to send everything)
+
+        Without a baseline, the client should forget about every player before
+        applying the update (known should be empty).
+        """
+        entered = visible - known
+        if changed is None:
+            updated = visible - entered
+        else:
+            updated = [p for p in visible - entered if p.username in changed]
+
+        update = {
+            "type": "update",
+            "tick": self.ticker.tick,
+            "time": self.ticker.time,
+            "seq": seq,
+            "baseline": baseline,
+            "players": {p.username: p.state_for_update() for p in updated},
+            "gone_players": [p.username for p in known - visible],
+            "new_players": {
+                p.username: p.state_for_initialization() for p in entered
             }
-
-            # send updates to all the players
-            async with trio.open_nursery() as nursery:
-                for player in self.players.value.values():
-                    nursery.start_soon(player.stream.write,
-                                       existing_player_update)
-                for player in new_players:
-                    nursery.start_soon(player.stream.write,
-                                       new_player_update)
-
-            # add new_players to the existing player list
-            for player in new_players:
-                log.debug(f"Add new player: {player}")
-                self.players.value[player.username] = player
\ No newline at end of file
+        }
+        if baseline is None:
+            update["reset"] = True
+        return update
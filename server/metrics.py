@@ -0,0 +1,279 @@
+""" What the server is doing, for debugging and profiling
+
+- histograms of the time spent in every phase of a tick, and other things
+  the game measures (see PHASES and the metrics below). Observing a value is
+  only a bisect in a short list, so they are always on.
+- serve: a tiny HTTP server on a debug port (METRICS_PORT, localhost only)
+  that gives every metric in the Prometheus text format:
+
+    $ curl localhost:9044/metrics
+
+- profile_on_signal: `kill -USR1 <pid>` samples the stacks of the server for
+  PROFILE_DURATION seconds, and writes them in a file, in the collapsed format
+  of flamegraph.pl (one line per stack, with how many times it was seen).
+
+The metrics are module level (like the logging loggers), so that anything
+can record something without having to be given a registry.
+"""
+
+import bisect
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import trio
+from constants import *
+
+log = logging.getLogger(__name__)
+
+# from 10µs to ~10s
+DEFAULT_BUCKETS = tuple(10e-6 * 2 ** i for i in range(21))
+
+class Histogram:
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        # counts[i] is the number of values <= buckets[i] (and > buckets[i-1]),
+        # the last one is for the values bigger than every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        """ with histogram.time(): ... observes how long the block took """
+        return _Timer(self)
+
+    def samples(self):
+        """ (suffix, labels, value) in the Prometheus format """
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield '_bucket', {**self.labels, 'le': f"{bound:g}"}, total
+        yield '_bucket', {**self.labels, 'le': '+Inf'}, self.count
+        yield '_sum', self.labels, self.sum
+        yield '_count', self.labels, self.count
+
+class _Timer:
+
+    __slots__ = 'histogram', 'start'
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Registry:
+
+    def __init__(self):
+        # name -> (type, help, [metrics with that name])
+        self._metrics = collections.OrderedDict()
+        # functions that yield (name, type, help, labels, value) when scraped
+        self._collectors = []
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        histogram = Histogram(name, help, buckets, labels)
+        self._metrics.setdefault(name, ('histogram', help, []))[2].append(histogram)
+        return histogram
+
+    def collector(self, fn):
+        """ fn() is called every time the metrics are read (for gauges and
+        counters that are kept somewhere else) """
+        self._collectors.append(fn)
+        return fn
+
+    def remove_collector(self, fn):
+        self._collectors.remove(fn)
+
+    def render(self):
+        """ Every metric in the Prometheus text format """
+        lines = []
+        for name, (type, help, metrics) in self._metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            for metric in metrics:
+                for suffix, labels, value in metric.samples():
+                    lines.append(_sample(name + suffix, labels, value))
+
+        # the samples of a metric have to be together
+        collected = collections.OrderedDict()
+        for collector in self._collectors:
+            for name, type, help, labels, value in collector():
+                if name not in collected:
+                    collected[name] = [f"# HELP {name} {help}",
+                                       f"# TYPE {name} {type}"]
+                collected[name].append(_sample(name, labels, value))
+        for samples in collected.values():
+            lines += samples
+        return '\n'.join(lines) + '\n'
+
+def _sample(name, labels, value):
+    if not labels:
+        return f"{name} {value}"
+    labels = ','.join(f'{key}="{_escape(value)}"'
+                      for key, value in labels.items())
+    return f"{name}{{{labels}}} {value}"
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+REGISTRY = Registry()
+
+# the phases of a tick (and of an update), see Game. The inputs aren't
+# applied during the tick but as soon as they arrive (Player.handle_input),
+# 'input' is the time spent doing that
+PHASES = {
+    phase: REGISTRY.histogram('nine42_phase_seconds',
+                              "Time spent in every phase of the game loop",
+                              phase=phase)
+    for phase in ('input', 'joins', 'move', 'collisions', 'snapshot',
+                  'serialize', 'send')
+}
+TICKS_PER_LOOP = REGISTRY.histogram('nine42_ticks_per_loop',
+    "Ticks simulated by one loop (more than one: catching up)",
+    buckets=range(1, MAX_CATCHUP_TICKS + 1))
+UPDATE_BYTES = REGISTRY.histogram('nine42_update_bytes',
+    "Size of the encoded updates", buckets=tuple(2 ** i for i in range(6, 21)))
+OUTBOX_DEPTH = REGISTRY.histogram('nine42_outbox_depth',
+    "Updates waiting in an outbox when a new one is put",
+    buckets=range(OUTBOX_SIZE + 1))
+REGISTRY_WAIT = REGISTRY.histogram('nine42_registry_wait_seconds',
+    "Time joins and leaves waited before being applied (see server.registry)")
+
+def game_collector(game):
+    """ Collects the counters and gauges of a game, and of its players """
+    def collect():
+        yield ('nine42_players', 'gauge', "Players in the game", {},
+               len(game.registry))
+        yield ('nine42_registry_queue', 'gauge',
+               "Joins and leaves waiting for the next tick", {},
+               len(game.registry._commands))
+        yield ('nine42_registry_max_wait_seconds', 'gauge',
+               "Longest a join or a leave waited before being applied", {},
+               game.registry.max_wait)
+        yield ('nine42_ticks_total', 'counter', "Ticks simulated", {},
+               game.ticker.tick)
+        yield ('nine42_tick_overruns_total', 'counter',
+               "Loops that had to run more than one tick", {},
+               game.ticker.overruns)
+        yield ('nine42_ticks_dropped_total', 'counter',
+               "Ticks that were never simulated", {}, game.ticker.dropped)
+        yield ('nine42_late_updates_total', 'counter',
+               "Broadcasts that started late", {}, game.late_updates)
+
+        for player in game.registry.snapshot.values():
+            labels = {'username': player.username}
+            yield ('nine42_outbox', 'gauge', "Updates waiting to be sent",
+                   labels, len(player.outbox))
+            yield ('nine42_outbox_dropped_total', 'counter',
+                   "Updates dropped because the client was too slow", labels,
+                   player.outbox.dropped)
+            yield ('nine42_client_throttled_total', 'counter',
+                   "Times the client sent too much and we stopped reading it",
+                   labels, player.throttled)
+            yield ('nine42_client_inputs_dropped_total', 'counter',
+                   "Datagrams dropped because the client sent too much",
+                   labels, player.inputs_dropped)
+            for direction in ('received', 'sent'):
+                streams = [player.stream, player.udp]
+                yield (f'nine42_client_messages_{direction}_total', 'counter',
+                       f"Messages {direction} (TCP and UDP)", labels,
+                       sum(getattr(s, f'messages_{direction}')
+                           for s in streams if s is not None))
+                yield (f'nine42_client_bytes_{direction}_total', 'counter',
+                       f"Bytes {direction} (TCP and UDP)", labels,
+                       sum(getattr(s, f'bytes_{direction}')
+                           for s in streams if s is not None))
+    return collect
+
+async def serve(port=METRICS_PORT, registry=REGISTRY,
+                task_status=trio.TASK_STATUS_IGNORED):
+    """ Serves the metrics over HTTP on localhost """
+    async def handler(stream):
+        request = b''
+        with trio.move_on_after(5):
+            while b'\r\n\r\n' not in request and len(request) < BUFSIZE:
+                data = await stream.receive_some(BUFSIZE)
+                if not data:
+                    return
+                request += data
+
+        line = request.split(b'\r\n', 1)[0].split()
+        if len(line) >= 2 and line[0] == b'GET' and line[1] == b'/metrics':
+            status = '200 OK'
+            body = registry.render().encode('utf-8')
+        else:
+            status = '404 Not Found'
+            body = b'try /metrics\n'
+
+        head = (f"HTTP/1.0 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n").encode('ascii')
+        try:
+            await stream.send_all(head + body)
+        except (trio.BrokenResourceError, trio.ClosedResourceError):
+            pass
+
+    try:
+        listeners = await trio.open_tcp_listeners(port, host='127.0.0.1')
+    except OSError as e:
+        # it's only for debugging, the game can run without it
+        log.error(f"Can't serve the metrics on port {port}: {e}")
+        return
+    log.info(f"Metrics on http://127.0.0.1:{port}/metrics")
+    await trio.serve_listeners(handler, listeners, task_status=task_status)
+
+def sample_stacks(thread_id, duration, interval):
+    """ Samples the stack of a thread from another thread, returns
+    {collapsed stack: count} """
+    stacks = collections.Counter()
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}"
+                         f":{frame.f_lineno})")
+            frame = frame.f_back
+        if names:
+            stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+async def profile_on_signal(signum=None, duration=PROFILE_DURATION,
+                            interval=PROFILE_INTERVAL):
+    """ Writes a profile every time the process gets signum (SIGUSR1 by
+    default, there's no profiler on the platforms that don't have it) """
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            log.info("No SIGUSR1 on this platform, the profiler is off")
+            return
+    thread_id = threading.get_ident()
+    with trio.open_signal_receiver(signum) as signals:
+        async for _ in signals:
+            log.warning(f"Profiling for {duration} seconds")
+            stacks = await trio.to_thread.run_sync(sample_stacks, thread_id,
+                                                   duration, interval)
+            path = f"profile-{os.getpid()}-{int(time.time())}.txt"
+            with open(path, 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            log.warning(f"Profile written to {path} "
+                        f"({sum(stacks.values())} samples)")
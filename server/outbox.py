@@ -0,0 +1,75 @@
+""" The updates waiting to be sent to a player
+
+Every player has its own task that sends its updates (send_forever), so that
+the game loop never waits on a socket: it only puts updates in the outbox.
+If a client doesn't read fast enough, its outbox fills up, and the game
+decides what to do about it (see Game.handle_slow_player).
+"""
+
+import logging
+import trio
+import net
+from server import metrics
+from collections import deque
+from constants import *
+
+log = logging.getLogger(__name__)
+
+class Outbox:
+
+    def __init__(self, stream, size=OUTBOX_SIZE, send=None):
+        """ send is the coroutine function that sends a payload,
+        stream.write by default """
+        self.stream = stream
+        self.size = size
+        self._send = send or stream.write
+
+        self._payloads = deque()
+        self._not_empty = trio.Event()
+        self._cancel_scope = trio.CancelScope()
+
+        # updates that were dropped before being sent
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def full(self):
+        return len(self._payloads) >= self.size
+
+    @property
+    def closed(self):
+        return self._cancel_scope.cancel_called
+
+    def put(self, payload):
+        """ Queues some encoded bytes (net.encode), it never blocks """
+        if self.closed:
+            return
+        self._payloads.append(payload)
+        self._not_empty.set()
+
+    def clear(self):
+        """ Drops every update that hasn't been sent yet """
+        self.dropped += len(self._payloads)
+        self._payloads.clear()
+
+    def close(self):
+        """ Stops sending (even in the middle of an update) and aborts the
+        stream: it can't be used anymore after half an update """
+        self.clear()
+        self._cancel_scope.cancel()
+
+    async def send_forever(self):
+        with self._cancel_scope:
+            try:
+                while True:
+                    while not self._payloads:
+                        self._not_empty = trio.Event()
+                        await self._not_empty.wait()
+                    with metrics.PHASES['send'].time():
+                        await self._send(self._payloads.popleft())
+            except net.ConnectionClosed:
+                log.info(f"Stream closed, stop sending updates")
+                return
+
+        await self.stream.abort()
@@ -1,12 +1,43 @@
 import random
+import trio
 import net
+from server.outbox import Outbox
+from server.ratelimit import TokenBucket
+from server import metrics
+from collections import OrderedDict
 from logging import getLogger
+from logs import HotLog
 from constants import *
 
 log = getLogger(__name__)
+hot = HotLog(__name__)
 
 # shouldn't mix async and sync methods!!
 
+def coalesce_inputs(msgs):
+    """ Keeps what matters in a batch of messages from a client
+
+    The game only reads the keyboard state once per tick, so only the latest
+    keyboard message counts (the one with the highest seq, when they're
+    numbered, since the client's prediction waits for that seq), and only the
+    latest ack. Everything else (pings) is kept, in order.
+    """
+    keyboard = ack = None
+    kept = []
+    for msg in msgs:
+        type = msg.get('type')
+        if type == 'keyboard':
+            if (keyboard is None or 'seq' not in msg or 'seq' not in keyboard
+                    or msg['seq'] > keyboard['seq']):
+                keyboard = msg
+        elif type == 'ack':
+            if ack is None or msg['seq'] > ack['seq']:
+                ack = msg
+        else:
+            kept.append(msg)
+    kept.extend(msg for msg in (ack, keyboard) if msg is not None)
+    return kept
+
 class Player:
 
     def __init__(self, stream):
@@ -24,10 +55,55 @@ class Player:
         self.weak_side = random.randint(0, 3)
 
         self.keyboard_state = 0
+        # the sequence number of the last keyboard message, echoed in the
+        # updates so that the client knows which inputs we applied
+        self.input_seq = 0
+
+        # the wire formats supported by the client (see wire.negotiate)
+        self.codecs = []
+
+        # the last snapshot the client told us it applied
+        self.acked_seq = None
+
+        # the players we told the client about in each update (seq -> view,
+        # see Game.view_of). Updates can be lost (UDP), so what the client
+        # knows is the view of the last update it acked
+        self.views = OrderedDict()
+
+        # identifies the datagrams of the client (see Game.serve_udp)
+        self.token = None
+        # net.DatagramStream, once the client sent us a datagram
+        self.udp = None
+        # the client gave up on UDP ('no_udp'), everything stays on TCP
+        self.tcp_only = False
+
+        self.outbox = Outbox(stream, send=self.send_update)
+        # updates the player missed in a row because it was too slow
+        self.missed_updates = 0
+
+        # the messages the client can send (TCP and UDP together)
+        self.input_limit = TokenBucket(INPUT_RATE, INPUT_BURST)
+        # times we stopped reading the client's TCP stream because it sent
+        # too much, and datagrams dropped for the same reason
+        self.throttled = 0
+        self.inputs_dropped = 0
+
+    def sent_view(self, seq, view):
+        """ Remembers the view sent with the update seq """
+        self.views[seq] = view
+        if len(self.views) > SNAPSHOT_HISTORY:
+            self.views.popitem(last=False)
+
+    def acked_view(self):
+        """ The players the client knows about, None if we don't know (it
+        never acked anything, or it's too old) """
+        return self.views.get(self.acked_seq)
 
     async def get_username(self):
-        resp = await self.stream.read()
+        self.set_username(await self.stream.read())
 
+    def set_username(self, resp):
+        """ Reads the username handshake """
         if resp['type'] != 'username':
             raise ValueError(f"invalid response: type should be 'username' in {resp}")
 
@@ -35,6 +111,8 @@ class Player:
             raise ValueError(f"invalid response: 'username' key should be set in {resp}")
 
         self.username = resp['username']
+        # older clients only know about JSON
+        self.codecs = resp.get('codecs', ['json'])
         log.info(f"Player got username: {self.username}")
 
     def spawn(self, pos):
@@ -48,34 +126,96 @@ class Player:
         w = PLAYER_SIZE[0]
         h = PLAYER_SIZE[1]
         return (
-            (
-                # target left side between player left and right
-                p[0] <= t[0] <= p[0] + w
-                # target top side between player top and bottom
-                and p[1] <= t[1] <= p[1] + h
-            ) or (
-                # target right side between player left and right
-                p[0] <= t[0] + w <= p[0] + w
-                # target top side between player top and bottom
-                and p[1] <= t[1] + h <= p[1] + h
-            )
+            # target left side is before the player's right side, and target
+            # right side after player left side
+            t[0] <= p[0] + w and p[0] <= t[0] + w
+            # same thing vertically
+            and t[1] <= p[1] + h and p[1] <= t[1] + h
         )
 
+    def side_hit_by(self, target):
+        """ The side of the player that target is colliding with (0 top, 1
+        right, 2 bottom and 3 is left, like weak_side) """
+        dx = target.pos[0] - self.pos[0]
+        dy = target.pos[1] - self.pos[1]
+        if abs(dx) > abs(dy):
+            return 1 if dx > 0 else 3
+        return 2 if dy > 0 else 0
+
+    def is_hit_on_weak_side(self, target):
+        return self.side_hit_by(target) == self.weak_side
+
     async def get_user_input_forever(self):
         log.info(f"{self} Listening for user input")
         while True:
-            resp = await self.stream.read()
-            if resp['type'] != 'keyboard':
-                raise ValueError(f"Expected type='keyboard' in {resp}")
+            # everything that arrived since the last read, in one go
+            msgs = await self.stream.read_many()
+            wait = self.input_limit.consume(trio.current_time(), len(msgs))
+            for msg in coalesce_inputs(msgs):
+                if msg['type'] == 'ping':
+                    # clock sync (see net.ClockSync), only over TCP
+                    await self.stream.pong(msg, trio.current_time())
+                else:
+                    self.handle_input(msg)
+
+            if wait > 0:
+                # flooding: stop reading for a while, TCP makes the client
+                # wait too
+                self.throttled += 1
+                hot.info("%s sent too many messages, not reading for %.3fs",
+                         self, wait)
+                await trio.sleep(wait)
+
+    def handle_input(self, resp):
+        """ Input from the client, over TCP or UDP """
+        with metrics.PHASES['input'].time():
+            self._apply_input(resp)
+
+    def _apply_input(self, resp):
+        if resp['type'] == 'keyboard':
+            # older clients don't number their inputs
+            seq = resp.get('seq', self.input_seq + 1)
+            if seq <= self.input_seq:
+                # older than the one we have (it can come over TCP or UDP)
+                return
             self.keyboard_state = resp['state']
+            self.input_seq = seq
+        elif resp['type'] == 'ack':
+            # ignore acks older than the one we have
+            if self.acked_seq is None or resp['seq'] > self.acked_seq:
+                self.acked_seq = resp['seq']
+        elif resp['type'] == 'no_udp':
+            # the client can't use UDP anymore, it wouldn't get the updates
+            log.info(f"{self} gave up on UDP, using TCP from now on")
+            self.tcp_only = True
+            self.udp = None
+        else:
+            raise ValueError(f"Expected type='keyboard', 'ack' or 'no_udp' "
+                             f"in {resp}")
+
+    async def send_update(self, payload):
+        """ Sends an update over UDP if we can, otherwise (or if it doesn't fit
+        in a datagram) over TCP """
+        if self.udp is not None:
+            try:
+                return await self.udp.write(payload)
+            except net.DatagramTooBig:
+                hot.debug("%s update too big for UDP, using TCP", self)
+            except net.ConnectionClosed:
+                log.warning(f"{self} UDP failed, using TCP from now on")
+                self.udp = None
+        await self.stream.write(payload)
 
     async def killed(self):
         await self.stream.write({
             "type": "dead"
         })
 
+    def despawn(self):
+        self.pos = None
+
     def move(self, loop_time):
-        """ Move according to the keyboard state """
+        """ Move according to the keyboard state, without leaving the map """
         if self.keyboard_state & LEFT:
             self.pos[0] -= PLAYER_SPEED * loop_time
         if self.keyboard_state & RIGHT:
@@ -85,6 +225,9 @@ class Player:
         if self.keyboard_state & DOWN:
             self.pos[1] += PLAYER_SPEED * loop_time
 
+        self.pos[0] = min(max(self.pos[0], 0), MAP_SIZE[0] - PLAYER_SIZE[0])
+        self.pos[1] = min(max(self.pos[1], 0), MAP_SIZE[1] - PLAYER_SIZE[1])
+
     @property
     def is_on_map(self):
         return self.pos is not None
@@ -99,9 +242,15 @@ class Player:
     def state_for_update(self):
         """ State information that is send every update """
         return {
-            "pos": self.pos
+            "pos": self.pos,
+            "input": self.input_seq
         }
 
+    def snapshot_state(self):
+        """ An immutable copy of what's in state_for_update, used to find out
+        what changed between two snapshots """
+        return (*self.pos, self.input_seq)
+
     def __str__(self):
         return f"<s.Player {self.username!r} {self.color}>"
 
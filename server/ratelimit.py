@@ -0,0 +1,35 @@
+""" Limits how many messages a client can send
+
+A token bucket: it holds up to `burst` tokens, gets `rate` new tokens per
+second, and every message takes one. A client that sends messages at a normal
+pace never runs out, one that floods the server does.
+"""
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._last = None
+
+    def _refill(self, now):
+        if self._last is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, now, count=1):
+        """ Takes count tokens if there are enough, returns whether it did """
+        self._refill(now)
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+    def consume(self, now, count=1):
+        """ Takes count tokens even if there aren't enough, and returns how
+        long to wait (in seconds) until the bucket isn't in debt anymore """
+        self._refill(now)
+        self.tokens -= count
+        return max(0, -self.tokens / self.rate)
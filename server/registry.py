@@ -0,0 +1,111 @@
+""" The players in the game
+
+Nothing ever locks the registry:
+
+- readers use `snapshot`, an immutable mapping {username: player} that is
+  published again (only if something changed) at the end of every tick.
+- joins and leaves are queued, and only applied by the game loop at tick
+  boundaries (see apply).
+- usernames are reserved as soon as a player asks for one, so that duplicates
+  are refused straight away, without waiting for anything.
+
+To make sure nobody waits on the registry, it keeps track of how long the
+joins and leaves waited before being applied: the nine42_registry_wait_seconds
+histogram, and max_wait (see server.metrics).
+"""
+
+import trio
+from server import metrics
+from collections import deque
+from types import MappingProxyType
+
+class Registry:
+
+    def __init__(self):
+        self._players = {}
+        self.snapshot = MappingProxyType({})
+        self._dirty = False
+
+        self._usernames = set()
+        # the players whose username was freed before they left (killed)
+        self._released = set()
+        # (action, player, when it was queued)
+        self._commands = deque()
+
+        # the longest a command waited before being applied, in seconds
+        self.max_wait = 0
+
+    def __len__(self):
+        return len(self._players)
+
+    def __contains__(self, player):
+        return self._players.get(player.username) is player
+
+    def reserve(self, username):
+        """ Returns False if the username is already taken """
+        if username in self._usernames:
+            return False
+        self._usernames.add(username)
+        return True
+
+    def join(self, player):
+        """ The player will be added to the game at the next tick """
+        self._commands.append(('join', player, trio.current_time()))
+
+    def leave(self, player):
+        """ The player will be removed at the next tick, and its username
+        freed """
+        self._commands.append(('leave', player, trio.current_time()))
+
+    def apply(self):
+        """ Applies the queued joins and leaves, returns the players that
+        joined and the ones that were removed """
+        joined = []
+        removed = []
+        now = trio.current_time() if self._commands else None
+        while self._commands:
+            action, player, queued = self._commands.popleft()
+            wait = now - queued
+            metrics.REGISTRY_WAIT.observe(wait)
+            self.max_wait = max(self.max_wait, wait)
+
+            if action == 'join':
+                self._players[player.username] = player
+                self._dirty = True
+                joined.append(player)
+            elif action == 'leave':
+                if player in joined:
+                    # never made it to a tick
+                    joined.remove(player)
+                if self.remove(player):
+                    removed.append(player)
+                if player in self._released:
+                    # someone else might have taken the username since
+                    self._released.discard(player)
+                else:
+                    self._usernames.discard(player.username)
+        return joined, removed
+
+    def remove(self, player):
+        """ Removes the player right away (during a tick). Returns False if
+        it wasn't in the game (already killed for example). The username
+        stays reserved until the player leaves """
+        if player not in self:
+            return False
+        del self._players[player.username]
+        self._dirty = True
+        return True
+
+    def release(self, player):
+        """ Frees the username of a player that was removed, before it leaves
+        (the client can join again with it right away) """
+        if player not in self._released:
+            self._released.add(player)
+            self._usernames.discard(player.username)
+
+    def publish(self):
+        """ Publishes a new snapshot if anything changed """
+        if self._dirty:
+            self.snapshot = MappingProxyType(dict(self._players))
+            self._dirty = False
+        return self.snapshot
@@ -0,0 +1,48 @@
+""" Remembers the last few snapshots of the game that were sent to the
+players, so that each update only has to contain what changed since the last
+snapshot a player acknowledged (its baseline).
+
+A snapshot is just a dict {username: state}, where state is anything
+comparable (the position and the last input as a tuple for now).
+"""
+
+from collections import OrderedDict
+from constants import *
+
+class SnapshotHistory:
+
+    def __init__(self, size=SNAPSHOT_HISTORY):
+        self.size = size
+        self.seq = 0
+        self._snapshots = OrderedDict()
+
+    def record(self, snapshot):
+        """ Stores a snapshot and returns its sequence number """
+        self.seq += 1
+        self._snapshots[self.seq] = snapshot
+        if len(self._snapshots) > self.size:
+            self._snapshots.popitem(last=False)
+        return self.seq
+
+    def get(self, seq):
+        return self._snapshots.get(seq)
+
+    def delta(self, baseline, snapshot):
+        """ Returns the items of snapshot that changed since the baseline
+
+        If we don't know about the baseline anymore (the player never acked
+        anything, or it's too old), it returns None, and a full snapshot
+        should be sent instead.
+        """
+        if baseline is None:
+            return None
+
+        base = self._snapshots.get(baseline)
+        if base is None:
+            return None
+
+        return {
+            username: state
+            for username, state in snapshot.items()
+            if base.get(username) != state
+        }
@@ -0,0 +1,89 @@
+""" A uniform grid to find the players that are close to each other without
+looking at every pair of players.
+
+The map is cut in square cells, and every player is in the cell of its top
+left corner. As long as the cells are at least as big as the players, two
+players that collide are either in the same cell or in neighbouring cells.
+"""
+
+from collections import defaultdict
+from constants import *
+
+# the neighbours a cell has to check for collisions. The other half is checked
+# by the neighbours themselves, so that every pair is only yielded once.
+_FORWARD_NEIGHBOURS = (1, -1), (1, 0), (1, 1), (0, 1)
+
+class Grid:
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        if cell_size < max(PLAYER_SIZE):
+            raise ValueError(f"cells ({cell_size}) should be at least as big "
+                             f"as the players ({PLAYER_SIZE})")
+        self.cell_size = cell_size
+        # cell -> players in that cell
+        self.cells = defaultdict(set)
+        # player -> its cell
+        self._player_cells = {}
+
+    def cell(self, pos):
+        return int(pos[0] // self.cell_size), int(pos[1] // self.cell_size)
+
+    def insert(self, player):
+        cell = self.cell(player.pos)
+        self.cells[cell].add(player)
+        self._player_cells[player] = cell
+
+    def remove(self, player):
+        cell = self._player_cells.pop(player)
+        self._remove_from_cell(player, cell)
+
+    def update(self, player):
+        """ Call this every time the player moves """
+        old = self._player_cells[player]
+        new = self.cell(player.pos)
+        if old == new:
+            return
+        self._remove_from_cell(player, old)
+        self.cells[new].add(player)
+        self._player_cells[player] = new
+
+    def _remove_from_cell(self, player, cell):
+        players = self.cells[cell]
+        players.discard(player)
+        if not players:
+            del self.cells[cell]
+
+    def __contains__(self, player):
+        return player in self._player_cells
+
+    def __len__(self):
+        return len(self._player_cells)
+
+    def near(self, cell, distance=1):
+        """ Yields the players in the cells at most distance cells away """
+        x, y = cell
+        for dx in range(-distance, distance + 1):
+            for dy in range(-distance, distance + 1):
+                players = self.cells.get((x + dx, y + dy))
+                if players:
+                    yield from players
+
+    def candidate_pairs(self):
+        """ Yields the pairs of players that might collide (broad phase)
+
+        Every pair is only yielded once, and it's up to the caller to check
+        whether they actually collide.
+        """
+        for (x, y), players in self.cells.items():
+            players = list(players)
+            for i, player in enumerate(players):
+                for other in players[i + 1:]:
+                    yield player, other
+
+            for dx, dy in _FORWARD_NEIGHBOURS:
+                neighbours = self.cells.get((x + dx, y + dy))
+                if not neighbours:
+                    continue
+                for player in players:
+                    for other in neighbours:
+                        yield player, other
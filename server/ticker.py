@@ -0,0 +1,68 @@
+""" Fixed timestep for the game loop
+
+The simulation always moves forward by the same amount of time (1 / rate), no
+matter how long a loop actually took. The elapsed time is accumulated, and as
+many ticks as fit in it are ran. If the server falls too far behind, the extra
+time is dropped instead of trying to catch up forever (which would only make
+things worse).
+"""
+
+from constants import *
+
+class Ticker:
+
+    def __init__(self, rate=TICK_RATE, max_catchup=MAX_CATCHUP_TICKS):
+        # duration of one tick, in seconds
+        self.dt = 1 / rate
+        self.max_catchup = max_catchup
+
+        # number of ticks simulated since the start
+        self.tick = 0
+
+        self.accumulator = 0
+        self.last = None
+
+        # loops that had to run more than one tick to catch up
+        self.overruns = 0
+        # ticks that were never simulated because we were too far behind
+        self.dropped = 0
+
+    def start(self, now):
+        self.last = now
+        self.accumulator = 0
+
+    def advance(self, now):
+        """ Returns how many ticks should be simulated to catch up with now """
+        if self.last is None:
+            raise RuntimeError("ticker wasn't started")
+
+        self.accumulator += now - self.last
+        self.last = now
+
+        ticks = int(self.accumulator // self.dt)
+        if ticks > self.max_catchup:
+            self.dropped += ticks - self.max_catchup
+            ticks = self.max_catchup
+            # forget about the time we can't simulate, only keep what's left
+            # of a tick
+            self.accumulator %= self.dt
+        else:
+            self.accumulator -= ticks * self.dt
+
+        if ticks > 1:
+            self.overruns += 1
+
+        self.tick += ticks
+        return ticks
+
+    @property
+    def time(self):
+        """ The time the simulation is at: the time left in the accumulator
+        hasn't been simulated yet """
+        if self.last is None:
+            return None
+        return self.last - self.accumulator
+
+    def next_deadline(self):
+        """ When the next tick is due (same clock as the one given to advance) """
+        return self.last + self.dt - self.accumulator
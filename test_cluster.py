@@ -0,0 +1,63 @@
+import socket
+import trio
+import net
+from server.cluster import Supervisor
+
+async def connect(listeners, username, then=b''):
+    port = listeners[0].socket.getsockname()[1]
+    stream = net.JSONStream(await trio.open_tcp_stream('127.0.0.1', port))
+    # send the handshake and the first message in one go, so that the front
+    # end has to hand over what it buffered after the handshake
+    handshake = stream.encode({'type': 'username', 'username': username,
+                               'codecs': ['json']})
+    await stream.write(handshake + then)
+    return stream
+
+async def test_cluster_hands_players_over_to_workers():
+    supervisor = Supervisor(2, log_file=None)
+    with trio.fail_after(30):
+        async with trio.open_nursery() as nursery:
+            listeners = await nursery.start(supervisor.run, 0)
+            assert sorted(supervisor.workers) == [0, 1]
+
+            streams = []
+            for username in ('a', 'b'):
+                stream = await connect(listeners, username,
+                    net.encode({'type': 'keyboard', 'state': 0}))
+                assert (await stream.read())['type'] == 'accepted'
+                streams.append(stream)
+
+            # one player on each worker
+            assert sorted(supervisor.loads().values()) == [1, 1]
+
+            # the worker runs a game, which sends updates
+            update = await streams[0].read()
+            assert update['type'] == 'update'
+
+            for stream in streams:
+                await stream.aclose()
+            nursery.cancel_scope.cancel()
+
+async def test_players_go_to_another_worker_if_one_is_broken():
+    supervisor = Supervisor(2, log_file=None)
+    with trio.fail_after(30):
+        async with trio.open_nursery() as nursery:
+            listeners = await nursery.start(supervisor.run, 0)
+
+            # the supervisor can't send anything to the worker it would
+            # pick anymore (but it doesn't know yet, it's not reading there)
+            broken = supervisor.pick_worker()
+            control = broken.sock
+            broken.sock = trio.socket.socket(socket.AF_UNIX,
+                                             socket.SOCK_SEQPACKET)
+            broken.sock.close()
+
+            stream = await connect(listeners, 'a')
+            assert (await stream.read())['type'] == 'accepted'
+            assert broken not in supervisor.workers.values()
+            assert list(supervisor.loads().values()) == [1]
+
+            # so that the worker exits
+            control.close()
+            await stream.aclose()
+            nursery.cancel_scope.cancel()
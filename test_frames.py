@@ -0,0 +1,31 @@
+import pytest
+import trio
+
+from client.frames import FrameScheduler
+
+async def test_frames_are_paced_without_blocking(autojump_clock):
+    frames = FrameScheduler(fps=10)
+    # the other tasks run while we wait for the next frame
+    reads = []
+    async def read_network():
+        while True:
+            await trio.sleep(.01)
+            reads.append(trio.current_time())
+
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(read_network)
+        start = trio.current_time()
+        for _ in range(10):
+            await frames.wait()
+        assert trio.current_time() - start == pytest.approx(1)
+        assert frames.fps == pytest.approx(10)
+        assert len(reads) >= 90
+
+        # a late frame starts right away, and the next ones don't catch up
+        await trio.sleep(.35)
+        late = trio.current_time()
+        await frames.wait()
+        assert trio.current_time() == late
+        await frames.wait()
+        assert trio.current_time() == pytest.approx(late + .1)
+        nursery.cancel_scope.cancel()
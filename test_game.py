@@ -0,0 +1,313 @@
+import random
+import pytest
+import trio
+import trio.testing
+
+import net
+import wire
+from constants import *
+from fakes import FakeStream, make_server_game, add_player, make_client_game
+from server.player import Player, coalesce_inputs
+from server.ratelimit import TokenBucket
+
+def update_for(game, player, changed=None):
+    """ The next update of player, as if it acked the last one """
+    visible = game.view_of(player, {})
+    known = player.acked_view() or frozenset()
+    seq = (player.acked_seq or 0) + 1
+    update = game.make_update(seq, None, known, visible, changed)
+    player.sent_view(seq, visible)
+    player.acked_seq = seq
+    return update
+
+async def test_players_only_see_around_them():
+    game = make_server_game(view_distance=1)
+    a = add_player(game, 'a', (0, 0))
+    b = add_player(game, 'b', (GRID_CELL_SIZE, 0))
+    c = add_player(game, 'c', (GRID_CELL_SIZE * 5, 0))
+
+    update = update_for(game, a)
+    assert update['new_players'].keys() == {'a', 'b'}
+    assert update['gone_players'] == []
+
+    # b leaves the view, c gets in
+    b.pos = [GRID_CELL_SIZE * 5, 0]
+    game.grid.update(b)
+    c.pos = [GRID_CELL_SIZE, 0]
+    game.grid.update(c)
+
+    update = update_for(game, a)
+    assert update['new_players'].keys() == {'c'}
+    assert update['gone_players'] == ['b']
+    assert update['players'].keys() == {'a'}
+
+async def test_gone_players_leave_the_view():
+    game = make_server_game(view_distance=None)
+    a = add_player(game, 'a', (0, 0))
+    b = add_player(game, 'b', (400, 400))
+    update_for(game, a)
+
+    game.registry.leave(b)
+    game.apply_joins_and_leaves()
+    update = update_for(game, a, changed={})
+    assert update['gone_players'] == ['b']
+    assert update['players'] == {}
+    assert update['new_players'] == {}
+
+def test_numpy_backend_moves_like_python_backend():
+    pytest.importorskip('numpy')
+    from server.arrays import PlayerArrays, ArrayPlayer
+
+    arrays = PlayerArrays(capacity=2)
+    states = [0, LEFT, RIGHT | DOWN, UP | LEFT, UP | DOWN, RIGHT]
+    spawns = [(0, 0), (10, 10), (470, 470), (5, 200), (250, 250), (100, 3)]
+
+    players = []
+    for spawn, state in zip(spawns, states):
+        for player in (Player(None), ArrayPlayer(arrays, None)):
+            player.spawn(spawn)
+            player.keyboard_state = state
+            players.append(player)
+
+    for _ in range(120):
+        arrays.move(1 / TICK_RATE, GRID_CELL_SIZE)
+        for player in players[::2]:
+            player.move(1 / TICK_RATE)
+
+    for python, array in zip(players[::2], players[1::2]):
+        assert array.snapshot_state() == pytest.approx(python.snapshot_state())
+
+async def test_numpy_backend_kills_like_python_backend():
+    pytest.importorskip('numpy')
+    spawns = random.Random(42)
+    games = [make_server_game(backend=backend)
+             for backend in ('python', 'numpy')]
+    for i in range(300):
+        pos = (spawns.uniform(0, MAP_SIZE[0] - PLAYER_SIZE[0]),
+               spawns.uniform(0, MAP_SIZE[1] - PLAYER_SIZE[1]))
+        weak_side = spawns.choice([None, 0, 1, 2, 3])
+        for game in games:
+            add_player(game, f"player{i}", pos).weak_side = weak_side
+
+    python, numpy = games
+    hits = {(player.username, killer.username)
+            for player, killer in python.hits()}
+    assert hits
+    assert hits == {(player.username, killer.username)
+                    for player, killer in numpy.arrays.hits(GRID_CELL_SIZE)}
+
+    for game in games:
+        game.check_collisions()
+    assert python.registry.publish().keys() == numpy.registry.publish().keys()
+
+def test_array_player_slots_are_reused():
+    pytest.importorskip('numpy')
+    from server.arrays import PlayerArrays, ArrayPlayer
+
+    arrays = PlayerArrays(capacity=1)
+    a, b = ArrayPlayer(arrays, None), ArrayPlayer(arrays, None)
+    color = a.color
+    a.spawn((1, 2))
+    b.spawn((3, 4))
+    assert len(arrays) == 2
+    assert a.color == color
+    assert a.state_for_update() == {"pos": [1, 2], "input": 0}
+
+    a.despawn()
+    assert len(arrays) == 1
+    assert a.color == color
+    assert b.pos.tolist() == [3, 4]
+
+async def test_slow_players_only_get_the_newest_update_when_coalescing():
+    game = make_server_game(view_distance=None)
+    game.slow_player_policy = 'coalesce'
+    game.ticker.start(0)
+    slow = add_player(game, 'slow', (0, 0))
+    add_player(game, 'other', (200, 200))
+
+    game.send_updates()
+    # it never acked anything: everything, from scratch
+    first = wire.JSON.decode(slow.outbox._payloads[0])
+    assert first['reset'] is True and first['baseline'] is None
+    assert first['new_players'].keys() == {'slow', 'other'}
+    slow.acked_seq = first['seq']
+
+    # the first one wasn't sent yet, these replace it (and each other)
+    add_player(game, 'new', (400, 400))
+    game.send_updates()
+    game.send_updates()
+
+    # the newest one is still relative to what the client acked
+    assert len(slow.outbox) == 1
+    assert slow.outbox.dropped == 2
+    update = wire.JSON.decode(slow.outbox._payloads[0])
+    assert update['seq'] == first['seq'] + 2
+    assert 'reset' not in update
+    assert update['baseline'] == first['seq']
+    assert update['new_players'].keys() == {'new'}
+    assert update['players'] == {}
+
+    # and it's the only one that goes out
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(slow.outbox.send_forever)
+        await trio.testing.wait_all_tasks_blocked()
+        nursery.cancel_scope.cancel()
+    assert [wire.JSON.decode(payload)['seq']
+            for payload in slow.stream.written] == [update['seq']]
+
+async def test_slow_players_get_disconnected():
+    game = make_server_game(view_distance=None)
+    game.slow_player_policy = 'disconnect'
+    slow = add_player(game, 'slow', (0, 0))
+
+    for _ in range(OUTBOX_SIZE + MAX_MISSED_UPDATES):
+        game.send_updates()
+    assert not slow.outbox.closed
+    assert len(slow.outbox) == OUTBOX_SIZE
+
+    game.send_updates()
+    assert slow.outbox.closed
+
+async def test_duplicate_usernames_are_refused_until_the_player_leaves():
+    game = make_server_game()
+    a = add_player(game, 'a', (0, 0))
+    assert not game.registry.reserve('a')
+
+    game.registry.leave(a)
+    game.apply_joins_and_leaves()
+    assert game.registry.publish() == {}
+    assert a not in game.grid and a.pos is None
+    assert game.registry.reserve('a')
+
+def test_only_the_latest_inputs_of_a_batch_are_kept():
+    msgs = [
+        {'type': 'keyboard', 'state': UP, 'seq': 1},
+        {'type': 'ping', 't0': 1},
+        {'type': 'ack', 'seq': 5},
+        # the keyboard messages can be out of order (UDP)
+        {'type': 'keyboard', 'state': LEFT, 'seq': 3},
+        {'type': 'keyboard', 'state': DOWN, 'seq': 2},
+        {'type': 'ack', 'seq': 4},
+        {'type': 'ping', 't0': 2},
+    ]
+    assert coalesce_inputs(msgs) == [
+        {'type': 'ping', 't0': 1},
+        {'type': 'ping', 't0': 2},
+        {'type': 'ack', 'seq': 5},
+        {'type': 'keyboard', 'state': LEFT, 'seq': 3},
+    ]
+    # without sequence numbers, the last one wins
+    assert coalesce_inputs([{'type': 'keyboard', 'state': UP},
+                            {'type': 'keyboard', 'state': 0}]) == [
+        {'type': 'keyboard', 'state': 0}]
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=5)
+    assert all(bucket.take(0) for _ in range(5))
+    assert not bucket.take(0)
+    # one token every .1s
+    assert bucket.take(.1)
+    assert not bucket.take(.1)
+    # never more than the burst
+    assert not bucket.take(10, count=6)
+    # 3 tokens in debt: .3s before it can take anything again
+    assert bucket.consume(10, count=8) == pytest.approx(.3)
+    assert not bucket.take(10.2)
+    assert bucket.take(10.45)
+
+def next_update(game, player):
+    game.send_updates()
+    update = wire.JSON.decode(player.outbox._payloads.pop())
+    player.outbox.clear()
+    return update
+
+async def test_lost_updates_dont_lose_players():
+    game = make_server_game(view_distance=None)
+    me = add_player(game, 'me', (0, 0))
+    client_game = make_client_game('me')
+    game.ticker.start(0)
+
+    def apply(update):
+        client_game.apply_update(update)
+        # the client acks what it applied
+        me.acked_seq = client_game.last_seq
+
+    apply(next_update(game, me))
+    assert client_game.players.keys() == {'me'}
+
+    # the update with the new player is lost
+    b = add_player(game, 'b', (100, 100))
+    next_update(game, me)
+    apply(next_update(game, me))
+    assert client_game.players.keys() == {'me', 'b'}
+
+    # the update with the player leaving is lost
+    game.registry.leave(b)
+    game.apply_joins_and_leaves()
+    next_update(game, me)
+    apply(next_update(game, me))
+    assert client_game.players.keys() == {'me'}
+
+    # an update arrives after a newer one (it was too big for UDP)
+    add_player(game, 'c', (200, 200))
+    late = next_update(game, me)
+    apply(next_update(game, me))
+    apply(late)
+    assert client_game.players.keys() == {'me', 'c'}
+
+async def test_killed_players_are_told_and_disconnected():
+    game = make_server_game()
+    a = add_player(game, 'a', (0, 0))
+    await game.notify_killed(a)
+    assert a.stream.written == [{'type': 'dead'}]
+    # the player leaves the game once its stream is closed
+    assert a.outbox.closed
+
+async def test_killed_players_can_join_again_right_away():
+    game = make_server_game()
+    a = add_player(game, 'a', (100, 100))
+    b = add_player(game, 'b', (85, 105))
+    a.weak_side = 3
+    b.weak_side = 0
+    game.check_collisions()
+    assert game.registry.publish().keys() == {'b'}
+
+    # before the old connection is even closed
+    assert game.registry.reserve('a')
+    again = Player(a.stream)
+    again.username = 'a'
+    again.spawn((500, 500))
+    game.registry.join(again)
+
+    # the old connection leaves, the username stays taken by the new one
+    game.registry.leave(a)
+    game.apply_joins_and_leaves()
+    assert game.registry.publish() == {'a': again, 'b': b}
+    assert not game.registry.reserve('a')
+
+async def test_clients_can_give_up_on_udp():
+    game = make_server_game()
+    player = add_player(game, 'a', (0, 0))
+    player.token = bytes(net.TOKEN_SIZE)
+    game.sessions[player.token] = player
+
+    player.handle_input({'type': 'no_udp'})
+    # a datagram that was sent before doesn't switch it back to UDP
+    game.handle_datagram(player.token + b'late', ('127.0.0.1', 1234))
+    assert player.tcp_only and player.udp is None
+
+async def test_the_server_is_told_when_udp_fails():
+    class BrokenUDP:
+        async def write(self, msg):
+            raise net.ConnectionClosed("unreachable")
+
+    game = make_client_game()
+    game.pdata.stream = FakeStream()
+    game.udp = BrokenUDP()
+    await game.send({'type': 'ack', 'seq': 1})
+    await game.send({'type': 'ack', 'seq': 2})
+    assert game.pdata.stream.written == [
+        {'type': 'no_udp'},
+        {'type': 'ack', 'seq': 1},
+        {'type': 'ack', 'seq': 2},
+    ]
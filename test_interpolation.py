@@ -0,0 +1,55 @@
+import pytest
+
+from client.interpolation import Interpolator, Timeline
+
+def test_interpolates_between_snapshots():
+    interpolator = Interpolator()
+    interpolator.push(1, (0, 0))
+    interpolator.push(2, (10, 20))
+    interpolator.push(3, (10, 20))
+
+    assert interpolator.position(.5) == [0, 0]
+    assert interpolator.position(1.5) == pytest.approx([5, 10])
+    assert interpolator.position(2.5) == pytest.approx([10, 20])
+
+def test_ignores_old_snapshots():
+    interpolator = Interpolator()
+    interpolator.push(2, (10, 10))
+    interpolator.push(1, (0, 0))
+    assert interpolator.position(1) == [10, 10]
+
+def test_extrapolation_is_bounded():
+    interpolator = Interpolator(max_extrapolation=.5)
+    interpolator.push(1, (0, 0))
+    interpolator.push(2, (10, 0))
+
+    assert interpolator.position(2.25) == pytest.approx([12.5, 0])
+    # stops after max_extrapolation
+    assert interpolator.position(10) == pytest.approx([15, 0])
+
+def test_timeline_renders_in_the_past():
+    timeline = Timeline(refresh_rate=.125)
+    assert timeline.render_time(0) is None
+
+    # 62.5ms latency, no jitter
+    for i in range(10):
+        timeline.observe(i * .125, i * .125 + .0625)
+    assert timeline.jitter == 0
+    assert timeline.render_time(1.3125) == pytest.approx(1.25 - .125)
+
+def test_timeline_adapts_delay_to_jitter():
+    timeline = Timeline(refresh_rate=.125, max_delay=1)
+    for i in range(100):
+        late = .1 if i % 2 else 0
+        timeline.observe(i * .125, i * .125 + late)
+    assert timeline.jitter > .05
+    assert timeline.target_delay > .125 + .1
+
+    # the delay grows slowly, and the render time never goes backwards
+    last = timeline.render_time(20)
+    for i in range(1, 100):
+        render = timeline.render_time(20 + i * .016)
+        assert render >= last
+        last = render
+    assert timeline.delay > .125
+    assert timeline.delay <= timeline.target_delay
@@ -0,0 +1,24 @@
+import logging
+
+from logs import HotLog
+
+class Explosive:
+
+    def __repr__(self):
+        raise AssertionError("formatted a message that isn't logged")
+
+def test_disabled_hot_log_formats_nothing(caplog):
+    hot = HotLog('test_disabled', every=1)
+    with caplog.at_level(logging.INFO, logger='test_disabled.hot'):
+        hot.debug("Read %r", Explosive())
+    assert caplog.records == []
+
+def test_hot_log_sampling(caplog):
+    hot = HotLog('test_sampling', every=10)
+    with caplog.at_level(logging.DEBUG, logger='test_sampling.hot'):
+        for i in range(100):
+            hot.debug("message %d", i)
+    assert [r.getMessage() for r in caplog.records] \
+        == [f"message {i}" for i in range(9, 100, 10)]
+    # the caller, not HotLog
+    assert caplog.records[0].funcName == 'test_hot_log_sampling'
@@ -0,0 +1,84 @@
+import trio
+from client.mailbox import Mailbox, merge_updates
+from fakes import make_client_game
+
+def state(x):
+    return {'pos': [x, 0], 'color': [0, 0, 0]}
+
+def make_update(seq, baseline=None, new=(), gone=(), moved=()):
+    return {
+        'type': 'update', 'seq': seq, 'baseline': baseline, 'tick': seq,
+        'time': seq / 10,
+        'players': {username: {'pos': [seq, seq]} for username in moved},
+        'new_players': {username: state(seq) for username in new},
+        'gone_players': list(gone),
+    }
+
+def test_mailbox_keeps_the_latest():
+    mailbox = Mailbox()
+    assert not mailbox and mailbox.take() is None
+    mailbox.put(1)
+    mailbox.put(2)
+    assert mailbox and mailbox.take() == 2
+    assert not mailbox and mailbox.replaced == 1
+
+    mailbox = Mailbox(merge=lambda older, newer: older + newer)
+    mailbox.put(1)
+    mailbox.put(2)
+    assert mailbox.take() == 3
+
+def test_newest_update_is_kept():
+    mailbox = Mailbox(merge=merge_updates)
+    mailbox.put((1, make_update(1, new=['a'])))
+    mailbox.put((2, make_update(3, new=['b'])))
+    # out of order (UDP)
+    mailbox.put((3, make_update(2, new=['c'])))
+    received, update = mailbox.take()
+    # when the update we keep arrived
+    assert received == 2 and update['seq'] == 3
+
+    # nothing matters after the player is dead
+    mailbox.put((4, {'type': 'dead'}))
+    mailbox.put((5, make_update(4)))
+    assert mailbox.take() == (4, {'type': 'dead'})
+
+async def test_updates_are_timed_when_they_arrive(autojump_clock):
+    from client.game import fetch_updates_forever
+    game = make_client_game()
+    mailbox = Mailbox(merge=merge_updates)
+    updates = iter([make_update(1), make_update(2)])
+
+    class Stream:
+        async def read(self):
+            await trio.sleep(1)
+            return next(updates)
+
+    with trio.move_on_after(2.5):
+        await fetch_updates_forever(Stream(), mailbox)
+    received, update = mailbox.take()
+    assert received == 2 and update['seq'] == 2
+
+    # applied later, the transit time is still the one when it arrived
+    await trio.sleep(5)
+    game.apply_update(update, received)
+    assert list(game.timeline.transits) == [received - update['time']]
+
+async def test_membership_is_relative_to_the_baseline():
+    game = make_client_game()
+    game.apply_update(make_update(1, new=['a', 'b']))
+    # 2 added c and was lost, 3 is relative to 1 so it has c too
+    game.apply_update(make_update(3, baseline=1, new=['c'], gone=['b'],
+                                  moved=['a']))
+    assert game.players.keys() == {'a', 'c'}
+    assert game.players['a'].server_pos == [3, 3]
+    assert game.players['c'].server_pos == [3, 0]
+
+    # relative to 1 again (3 wasn't acked yet): c is still new, a still there
+    c = game.players['c']
+    game.apply_update(make_update(4, baseline=1, new=['c'], gone=['b']))
+    assert game.players.keys() == {'a', 'c'}
+    assert game.players['c'] is c
+
+    # relative to 4: players we don't know about are ignored
+    game.apply_update(make_update(5, baseline=4, gone=['a', 'never-seen']))
+    assert game.players.keys() == {'c'}
@@ -0,0 +1,70 @@
+import trio
+
+from server import metrics
+from server.registry import Registry
+
+def test_histogram():
+    registry = metrics.Registry()
+    histogram = registry.histogram('test_seconds', "Test", buckets=(1, 2, 4),
+                                   phase='a')
+    for value in (.5, 1, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 0, 1, 1]
+    text = registry.render()
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{phase="a",le="1"} 2' in text
+    assert 'test_seconds_bucket{phase="a",le="4"} 3' in text
+    assert 'test_seconds_bucket{phase="a",le="+Inf"} 4' in text
+    assert 'test_seconds_sum{phase="a"} 14.5' in text
+
+def test_collector():
+    registry = metrics.Registry()
+    registry.collector(lambda: [
+        ('test_total', 'counter', "Test", {'username': 'a"b'}, 1),
+        ('test_depth', 'gauge', "Test", {'username': 'a"b'}, 0),
+        ('test_total', 'counter', "Test", {'username': 'c'}, 2),
+    ])
+    lines = registry.render().splitlines()
+    assert lines.count('# TYPE test_total counter') == 1
+    # the samples of a metric are together
+    assert lines.index('test_total{username="c"} 2') \
+        == lines.index('test_total{username="a\\"b"} 1') + 1
+
+async def test_serve():
+    registry = metrics.Registry()
+    registry.histogram('test_seconds', "Test").observe(1)
+
+    async with trio.open_nursery() as nursery:
+        listeners = await nursery.start(metrics.serve, 0, registry)
+        port = listeners[0].socket.getsockname()[1]
+
+        stream = await trio.open_tcp_stream('127.0.0.1', port)
+        await stream.send_all(b'GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n')
+        response = b''
+        while True:
+            data = await stream.receive_some(4096)
+            if not data:
+                break
+            response += data
+
+        assert response.startswith(b'HTTP/1.0 200 OK')
+        assert b'test_seconds_count 1' in response
+        nursery.cancel_scope.cancel()
+
+async def test_registry_waits_are_measured(autojump_clock):
+    registry = Registry()
+    count = metrics.REGISTRY_WAIT.count
+    assert registry.reserve('a')
+    registry.join(type('Player', (), {'username': 'a'})())
+    await trio.sleep(.5)
+    registry.apply()
+    assert metrics.REGISTRY_WAIT.count == count + 1
+    assert registry.max_wait == .5
+    assert 'nine42_registry_wait_seconds_count' in metrics.REGISTRY.render()
+
+async def test_no_profiler_without_sigusr1(monkeypatch):
+    monkeypatch.delattr(metrics.signal, 'SIGUSR1')
+    # returns right away instead of waiting for a signal
+    with trio.fail_after(1):
+        await metrics.profile_on_signal()
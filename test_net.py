@@ -73,13 +73,13 @@ async def test_read_multiple_object_per_message(objects):
     assert cancel_scope.cancelled_caught is False
 
 
-async def test_timed_stream_write_t_key_exception():
-    """ write shouldn't allow object with key 't' already set """
+async def test_timed_stream_write_seq_key_exception():
+    """ write shouldn't allow object with key 's' already set """
     a, b = trio.testing.memory_stream_pair()
     stream_tested = net.TimedStream(a)
 
     with pytest.raises(ValueError):
-        await stream_tested.write({net.TIME_KEY: 200})
+        await stream_tested.write({net.SEQ_KEY: 200})
 
 @hyp.given(st.lists(st.floats(min_value=0, max_value=0.005), min_size=1, max_size=10))
 async def test_timed_stream_message_discarding(delays):
@@ -129,4 +129,96 @@ async def test_timed_stream_message_discarding(delays):
                 {'order': sorted_delays.index(delay)},
                 delays[i%len(delays)])
 
-        n.start_soon(always_newer, stream_tested, len(delays))
\ No newline at end of file
+        n.start_soon(always_newer, stream_tested, len(delays))
+
+@hyp.given(serializable)
+async def test_write_encoded(obj):
+    """ Writing bytes from net.encode is the same as writing the dict """
+    a, b = trio.testing.memory_stream_pair()
+    writer = net.JSONStream(a)
+    reader = net.JSONStream(b)
+
+    await writer.write(net.encode(obj))
+    assert await reader.read() == obj
+
+
+@hyp.given(st.lists(serializable, min_size=1, max_size=10))
+async def test_read_many(objects):
+    """ read_many returns every message that arrived in one go """
+    a, stream_controlled = trio.testing.memory_stream_pair()
+    stream_tested = net.JSONStream(a)
+    string = ''.join(json.dumps(obj) + '\n' for obj in objects)
+
+    await stream_controlled.send_all(bytes(string, encoding='utf-8'))
+    with trio.move_on_after(1) as cancel_scope:
+        assert await stream_tested.read_many() == objects
+    assert cancel_scope.cancelled_caught is False
+
+
+def test_frame_buffer_compacts():
+    """ The consumed frames are eventually dropped from the buffer """
+    buf = net.FrameBuffer()
+    for i in range(100):
+        buf.feed(b'{}\n')
+        frame = buf.next_frame(net.wire.JSON)
+        assert bytes(frame) == b'{}\n'
+        frame.release()
+        assert len(buf) == 0
+    assert len(buf._buf) <= 2 * len(b'{}\n')
+
+
+async def _datagram_pair():
+    a = trio.socket.socket(trio.socket.AF_INET, trio.socket.SOCK_DGRAM)
+    b = trio.socket.socket(trio.socket.AF_INET, trio.socket.SOCK_DGRAM)
+    await a.bind(('127.0.0.1', 0))
+    await b.bind(('127.0.0.1', 0))
+    await a.connect(b.getsockname())
+    await b.connect(a.getsockname())
+    return a, b
+
+async def test_datagram_stream_discards_old_datagrams():
+    a, b = await _datagram_pair()
+    with a, b:
+        writer = net.DatagramStream(a)
+        reader = net.DatagramStream(b)
+
+        await writer.write({'order': 1})
+        old = net.DatagramStream(a)
+        # pretend this one was sent first, but arrived later
+        await writer.write({'order': 2})
+        await old.write({'order': 0})
+        await writer.write(net.encode({'order': 3}))
+
+        with trio.fail_after(1):
+            assert await reader.read() == {'order': 1}
+            assert await reader.read() == {'order': 2}
+            assert await reader.read() == {'order': 3}
+        assert reader.stale == 1
+
+async def test_datagram_stream_too_big():
+    a, b = await _datagram_pair()
+    with a, b:
+        writer = net.DatagramStream(a, token=b'x' * net.TOKEN_SIZE)
+        with pytest.raises(net.DatagramTooBig):
+            await writer.write({'data': 'x' * net.MAX_DATAGRAM_SIZE})
+
+def test_clock_sync():
+    """ The offset comes from the sample with the smallest round trip """
+    clock = net.ClockSync()
+    assert not clock.synced
+
+    # their clock is 100 seconds ahead, 50ms each way
+    ping = clock.ping(now=10)
+    pong = net.ClockSync.pong(ping, received=110.05, now=110.06)
+    rtt, offset = clock.handle_pong(pong, now=10.11)
+    assert rtt == pytest.approx(0.1)
+    assert offset == pytest.approx(100)
+
+    # stuck in a queue on the way back, so the offset looks wrong
+    pong = net.ClockSync.pong(clock.ping(now=20), received=120.05, now=120.05)
+    clock.handle_pong(pong, now=20.5)
+    assert clock.rtt == pytest.approx(0.1)
+    assert clock.offset == pytest.approx(100)
+
+    assert clock.remote_time(now=30) == pytest.approx(130)
+    assert clock.local_time(130) == pytest.approx(30)
@@ -0,0 +1,44 @@
+import pytest
+
+from client.prediction import Predictor, move
+from constants import *
+
+def test_moves_before_the_server_knows():
+    predictor = Predictor()
+    assert predictor.position(0) is None
+
+    predictor.reconcile((100, 100), 0, snapshot_time=0)
+    assert predictor.position(1) == [100, 100]
+
+    predictor.input(RIGHT, now=1)
+    assert predictor.position(1.5) == pytest.approx([100 + PLAYER_SPEED / 2, 100])
+    assert predictor.pending == 1
+
+def test_replays_the_inputs_the_server_did_not_apply():
+    predictor = Predictor()
+    predictor.reconcile((100, 100), 0, snapshot_time=0)
+    first = predictor.input(RIGHT, now=1)
+    predictor.input(DOWN, now=1.25)
+
+    # the server applied the first input for .125s when it took the snapshot
+    predictor.reconcile((110, 100), first, snapshot_time=1.125)
+    assert predictor.pending == 1
+    expected = move(move((110, 100), RIGHT, .125), DOWN, .25)
+    assert predictor.position(1.5) == pytest.approx(expected)
+
+def test_snapshot_time_is_clamped_to_the_input():
+    """ If the server applied the first input, the snapshot was taken after
+    it was sent, whatever the clock estimate says """
+    predictor = Predictor()
+    first = predictor.input(LEFT, now=1)
+    predictor.input(0, now=2)
+    predictor.reconcile((100, 100), first, snapshot_time=3)
+    assert predictor.position(4) == [100, 100]
+
+def test_old_acks_are_ignored():
+    predictor = Predictor()
+    first = predictor.input(RIGHT, now=1)
+    second = predictor.input(0, now=2)
+    predictor.reconcile((200, 100), second, snapshot_time=2)
+    predictor.reconcile((100, 100), first, snapshot_time=1.5)
+    assert predictor.position(3) == [200, 100]
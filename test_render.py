@@ -0,0 +1,92 @@
+import types
+import pygame
+import pygame.freetype
+
+from client.player import Player
+from client.resources import TextCache
+from client.camera import Camera
+from fakes import make_client_game
+
+def make_game():
+    pygame.freetype.init()
+    resources = types.SimpleNamespace(
+        text=TextCache(pygame.freetype.Font(None, 12)))
+    return make_client_game(resources=resources)
+
+def add_player(game, username, pos, color):
+    player = Player(username, pos, color, game.pdata.resources)
+    player.update(0)
+    player.place(game.camera)
+    game.players[username] = player
+    return player
+
+def move(game, player, pos):
+    player.update(0, predicted=pos)
+    player.place(game.camera)
+
+def full_render(game, srect):
+    surf = pygame.Surface(srect.size)
+    game.render(surf, srect)
+    return pygame.image.tobytes(surf, 'RGB')
+
+def test_dirty_rendering_looks_like_full_rendering():
+    game = make_game()
+    screen = pygame.Surface((200, 200))
+    srect = screen.get_rect()
+
+    a = add_player(game, 'a', [20, 40], (255, 0, 0))
+    b = add_player(game, 'b', [30, 50], (0, 255, 0))
+    add_player(game, 'c', [100, 100], (0, 0, 255))
+    assert game.render_dirty(screen, srect, [srect]) == [srect]
+    assert pygame.image.tobytes(screen, 'RGB') == full_render(game, srect)
+
+    # nothing moved, nothing to repaint
+    assert game.render_dirty(screen, srect, []) == []
+
+    # a moves from under b: b has to be repainted where a was
+    move(game, a, [25, 45])
+    old = game.drawn['a']
+    assert game.render_dirty(screen, srect, []) == [a.bounds().union(old)]
+    assert pygame.image.tobytes(screen, 'RGB') == full_render(game, srect)
+
+    del game.players['b']
+    assert game.render_dirty(screen, srect, []) == [b.bounds()]
+    assert pygame.image.tobytes(screen, 'RGB') == full_render(game, srect)
+
+def test_camera_follows_without_leaving_the_map():
+    camera = Camera(size=(100, 100), world=(1000, 500), margin=10)
+    assert camera.rect.topleft == (0, 0)
+    camera.follow((500, 250))
+    assert camera.rect.topleft == (450, 200)
+    assert camera.to_screen(pygame.Rect(460, 220, 10, 10)).topleft == (10, 20)
+    camera.follow((990, 10))
+    assert camera.rect.topleft == (900, 0)
+
+    # the map is smaller than the screen: it's centered
+    camera = Camera(size=(200, 100), world=(100, 500))
+    camera.follow((0, 0))
+    assert camera.rect.topleft == (-50, 0)
+
+def test_players_out_of_the_camera_are_not_drawn():
+    game = make_game()
+    game.camera = Camera(size=(100, 100), world=(1000, 1000), margin=10)
+    screen = pygame.Surface((100, 100))
+    srect = screen.get_rect()
+
+    near = add_player(game, 'near', [50, 50], (255, 0, 0))
+    # in the margin (its username might be on the screen)
+    edge = add_player(game, 'edge', [105, 50], (0, 255, 0))
+    far = add_player(game, 'far', [500, 500], (0, 0, 255))
+    assert near.screen_rect is not None and edge.screen_rect is not None
+    assert far.screen_rect is None
+    game.render_dirty(screen, srect, [srect])
+    assert game.drawn.keys() == {'near', 'edge'}
+
+    # the camera moves to far: the others are erased
+    game.camera.follow(far.rect.center)
+    for player in game.players.values():
+        player.place(game.camera)
+    assert far.screen_rect.center == srect.center
+    game.render_dirty(screen, srect, [])
+    assert game.drawn.keys() == {'far'}
+    assert pygame.image.tobytes(screen, 'RGB') == full_render(game, srect)
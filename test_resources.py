@@ -0,0 +1,33 @@
+import pygame.freetype
+
+from client.resources import TextCache
+from client.utils import *
+
+def make_cache(size):
+    pygame.freetype.init()
+    return TextCache(pygame.freetype.Font(None, 12), size)
+
+def test_text_cache_renders_once():
+    cache = make_cache(8)
+    surface = cache("player", (1, 2, 3))
+    # same text, same color (a list or a pygame.Color)
+    assert cache("player", [1, 2, 3]) is surface
+    assert cache("player", pygame.Color(1, 2, 3)) is surface
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    assert cache("player", RED) is not surface
+    assert cache("player", (1, 2, 3), size=20).get_height() > surface.get_height()
+    assert cache("player", (1, 2, 3), bgcolor=BLACK) is not surface
+
+def test_text_cache_drops_the_least_recently_used():
+    cache = make_cache(2)
+    a = cache("a")
+    cache("b")
+    # a is used again, so b is the oldest
+    assert cache("a") is a
+    cache("c")
+    assert len(cache) == 2
+    assert cache("a") is a
+    misses = cache.misses
+    cache("b")
+    assert cache.misses == misses + 1
@@ -0,0 +1,20 @@
+from server.snapshots import SnapshotHistory
+
+def test_delta_only_has_changes():
+    history = SnapshotHistory(size=4)
+    base = history.record({'a': (0, 0), 'b': (1, 1)})
+
+    delta = history.delta(base, {'a': (0, 0), 'b': (2, 1), 'c': (5, 5)})
+    assert delta == {'b': (2, 1), 'c': (5, 5)}
+
+def test_delta_without_baseline():
+    history = SnapshotHistory(size=2)
+    assert history.delta(None, {'a': (0, 0)}) is None
+
+    first = history.record({'a': (0, 0)})
+    history.record({'a': (1, 0)})
+    history.record({'a': (2, 0)})
+
+    # too old, forgotten
+    assert history.get(first) is None
+    assert history.delta(first, {'a': (2, 0)}) is None
@@ -0,0 +1,52 @@
+import itertools
+
+import hypothesis as hyp
+import hypothesis.strategies as st
+
+from constants import *
+from server.player import Player
+from server.spatial import Grid
+
+positions = st.tuples(st.floats(min_value=-50, max_value=MAP_SIZE[0]),
+                      st.floats(min_value=-50, max_value=MAP_SIZE[1]))
+
+def make_player(pos):
+    player = Player(None)
+    player.spawn(pos)
+    return player
+
+def colliding_pairs(pairs):
+    return {frozenset(pair) for pair in pairs if pair[0].collides(pair[1])}
+
+@hyp.given(st.lists(positions, max_size=40), st.lists(positions, max_size=40))
+def test_candidate_pairs_find_every_collision(spawns, moves):
+    """ The grid finds the same collisions as checking every pair, even
+    after the players moved """
+    grid = Grid(GRID_CELL_SIZE)
+    players = [make_player(pos) for pos in spawns]
+    for player in players:
+        grid.insert(player)
+
+    for player, pos in zip(players, moves):
+        player.pos = list(pos)
+        grid.update(player)
+
+    pairs = list(grid.candidate_pairs())
+    assert len(pairs) == len({frozenset(pair) for pair in pairs})
+    assert colliding_pairs(pairs) == \
+        colliding_pairs(itertools.combinations(players, 2))
+
+def test_remove():
+    grid = Grid(GRID_CELL_SIZE)
+    a, b = make_player((0, 0)), make_player((5, 5))
+    grid.insert(a)
+    grid.insert(b)
+    grid.remove(a)
+    assert a not in grid and len(grid) == 1
+    assert list(grid.candidate_pairs()) == []
+
+def test_weak_side():
+    player = make_player((100, 100))
+    player.weak_side = 3
+    assert player.is_hit_on_weak_side(make_player((85, 105)))
+    assert not player.is_hit_on_weak_side(make_player((115, 105)))
@@ -0,0 +1,38 @@
+import pytest
+
+from server.ticker import Ticker
+
+def test_ticks_at_fixed_rate():
+    ticker = Ticker(rate=10, max_catchup=5)
+    ticker.start(0)
+
+    assert ticker.advance(.05) == 0
+    assert ticker.advance(.1) == 1
+    assert ticker.advance(.35) == 2
+    assert ticker.tick == 3
+    assert ticker.overruns == 1
+    assert ticker.dropped == 0
+
+def test_next_deadline_accounts_for_leftover_time():
+    ticker = Ticker(rate=10)
+    ticker.start(0)
+    ticker.advance(.15)
+    assert ticker.next_deadline() == pytest.approx(.2)
+    # the simulation is only at .1
+    assert ticker.time == pytest.approx(.1)
+
+def test_catch_up_is_capped():
+    """ Falling far behind shouldn't make the next loop simulate everything
+    it missed """
+    ticker = Ticker(rate=4, max_catchup=3)
+    ticker.start(0)
+
+    assert ticker.advance(5.125) == 3
+    assert ticker.dropped == 17
+    assert ticker.next_deadline() == pytest.approx(5.25)
+    # back on track
+    assert ticker.advance(5.25) == 1
+
+def test_advance_before_start():
+    with pytest.raises(RuntimeError):
+        Ticker().advance(1)
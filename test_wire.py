@@ -0,0 +1,53 @@
+import pytest
+
+import hypothesis as hyp
+import hypothesis.strategies as st
+
+import wire
+
+usernames = st.text(min_size=1, max_size=40)
+positions = st.lists(st.integers(min_value=-1000, max_value=1000),
+                     min_size=2, max_size=2)
+
+updates = st.fixed_dictionaries({
+    'type': st.just('update'),
+    'seq': st.integers(min_value=0),
+    'players': st.dictionaries(usernames, st.fixed_dictionaries({
+        'pos': positions,
+        'input': st.integers(min_value=0, max_value=2**32),
+    })),
+    'gone_players': st.lists(usernames),
+})
+
+keyboards = st.fixed_dictionaries({
+    'type': st.just('keyboard'),
+    'state': st.integers(min_value=0, max_value=2**10),
+    'seq': st.integers(min_value=0, max_value=2**33),
+})
+
+others = st.dictionaries(st.text(min_size=1), st.integers())
+
+@pytest.mark.parametrize('codec', wire.CODECS.values(), ids=wire.CODECS.keys())
+@hyp.given(st.one_of(updates, keyboards, others))
+def test_round_trip(codec, obj):
+    frame = codec.encode(obj)
+    assert codec.frame_end(frame + b'garbage') == len(frame)
+    assert codec.frame_end(frame[:-1]) == -1
+    assert codec.decode(frame) == obj
+
+def test_binary_update_is_smaller():
+    update = {
+        'type': 'update',
+        'seq': 1,
+        'players': {
+            f"player{i}": {'pos': [i * 1.123456789, 500 - i * 0.987654321],
+                           'input': i}
+            for i in range(100)
+        },
+    }
+    assert len(wire.BINARY.encode(update)) < len(wire.JSON.encode(update))
+
+def test_negotiate():
+    assert wire.negotiate(['nope', 'binary', 'json']) is wire.BINARY
+    assert wire.negotiate(['json', 'binary']) is wire.JSON
+    assert wire.negotiate([]) is wire.JSON
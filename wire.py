@@ -0,0 +1,180 @@
+""" The formats used to put messages on the wire (see net.JSONStream)
+
+Every codec knows how to turn a message (a dict) into a frame, where a frame
+ends in a buffer, and how to turn a frame back into a message.
+
+- JSONCodec: newline delimited JSON. It's slow, but nice to debug with.
+- BinaryCodec: length prefixed frames. The hot messages ('update' and
+  'keyboard') are packed with struct, anything else is JSON.
+
+The codec is negotiated during the username handshake: the client says which
+codecs it supports (in order of preference) and the server picks one.
+"""
+
+import json
+import struct
+
+class JSONCodec:
+
+    name = 'json'
+
+    def encode(self, obj):
+        return (json.dumps(obj) + '\n').encode('utf-8')
+
+    def frame_end(self, buf, start=0, scan=0):
+        """ Returns the index right after the frame that starts at start in
+        buf, or -1 if it isn't complete yet.
+
+        The caller guarantees that the frame doesn't end before scan, so we
+        don't have to look at these bytes again.
+        """
+        i = buf.find(b'\n', max(start, scan))
+        if i == -1:
+            return -1
+        return i + 1
+
+    def decode(self, frame):
+        line = str(frame, encoding='utf-8')
+        if line.strip() == "":
+            raise ValueError(f"Invalid empty value: {line!r}")
+        return json.loads(line)
+
+# frame: <length: u32> <kind: u8> <payload>
+_LENGTH = struct.Struct('<I')
+_KIND = struct.Struct('<B')
+
+# anything, as JSON
+KIND_JSON = 0
+# <state: u8> <seq: u32>
+KIND_KEYBOARD = 1
+# <header length: u32> <header: JSON> <players count: u32>
+# and then for every player:
+#   <username length: u8> <username> <x: f32> <y: f32> <input: u32>
+# The header is the update without 'type' and 'players'
+KIND_UPDATE = 2
+
+_KEYBOARD = struct.Struct('<BI')
+_U32 = struct.Struct('<I')
+_NAME_LEN = struct.Struct('<B')
+_PLAYER = struct.Struct('<ffI')
+
+class BinaryCodec:
+
+    name = 'binary'
+
+    # refuse frames bigger than this, instead of buffering forever
+    max_frame_size = 1 << 24
+
+    def encode(self, obj):
+        payload = self._pack(obj)
+        return _LENGTH.pack(len(payload)) + payload
+
+    def _pack(self, obj):
+        if obj.get('type') == 'keyboard' \
+                and obj.keys() == {'type', 'state', 'seq'} \
+                and 0 <= obj['state'] <= 0xff and 0 <= obj['seq'] <= 0xffffffff:
+            return _KIND.pack(KIND_KEYBOARD) + _KEYBOARD.pack(obj['state'],
+                                                              obj['seq'])
+
+        if obj.get('type') == 'update':
+            payload = self._pack_update(obj)
+            if payload is not None:
+                return payload
+
+        return _KIND.pack(KIND_JSON) + json.dumps(obj).encode('utf-8')
+
+    def _pack_update(self, obj):
+        """ Returns None if the update can't be packed """
+        header = json.dumps({
+            key: value
+            for key, value in obj.items()
+            if key not in ('type', 'players')
+        }).encode('utf-8')
+
+        parts = [
+            _KIND.pack(KIND_UPDATE),
+            _U32.pack(len(header)),
+            header,
+            _U32.pack(len(obj['players'])),
+        ]
+
+        for username, state in obj['players'].items():
+            if state.keys() != {'pos', 'input'} \
+                    or not 0 <= state['input'] <= 0xffffffff:
+                return None
+            name = username.encode('utf-8')
+            if len(name) > 0xff:
+                return None
+            parts.append(_NAME_LEN.pack(len(name)))
+            parts.append(name)
+            parts.append(_PLAYER.pack(*state['pos'], state['input']))
+
+        return b''.join(parts)
+
+    def frame_end(self, buf, start=0, scan=0):
+        if len(buf) - start < _LENGTH.size:
+            return -1
+        length, = _LENGTH.unpack_from(buf, start)
+        if length > self.max_frame_size:
+            raise ValueError(f"frame too big ({length} bytes)")
+        end = start + _LENGTH.size + length
+        if len(buf) < end:
+            return -1
+        return end
+
+    def decode(self, frame):
+        try:
+            return self._unpack(frame)
+        except struct.error as e:
+            raise ValueError(f"Invalid frame {bytes(frame)!r}") from e
+
+    def _unpack(self, frame):
+        offset = _LENGTH.size
+        kind, = _KIND.unpack_from(frame, offset)
+        offset += _KIND.size
+
+        if kind == KIND_JSON:
+            return json.loads(bytes(frame[offset:]))
+
+        if kind == KIND_KEYBOARD:
+            state, seq = _KEYBOARD.unpack_from(frame, offset)
+            return {'type': 'keyboard', 'state': state, 'seq': seq}
+
+        if kind == KIND_UPDATE:
+            return self._unpack_update(frame, offset)
+
+        raise ValueError(f"Invalid frame kind {kind} in {bytes(frame)!r}")
+
+    def _unpack_update(self, frame, offset):
+        length, = _U32.unpack_from(frame, offset)
+        offset += _U32.size
+        obj = json.loads(bytes(frame[offset:offset + length]))
+        offset += length
+
+        obj['type'] = 'update'
+        obj['players'] = players = {}
+
+        count, = _U32.unpack_from(frame, offset)
+        offset += _U32.size
+        for _ in range(count):
+            length, = _NAME_LEN.unpack_from(frame, offset)
+            offset += _NAME_LEN.size
+            username = str(frame[offset:offset + length], encoding='utf-8')
+            offset += length
+            x, y, input = _PLAYER.unpack_from(frame, offset)
+            players[username] = {'pos': [x, y], 'input': input}
+            offset += _PLAYER.size
+
+        return obj
+
+JSON = JSONCodec()
+BINARY = BinaryCodec()
+
+CODECS = {codec.name: codec for codec in (JSON, BINARY)}
+
+def negotiate(names):
+    """ Picks the first codec we know about in names, JSON if there isn't any """
+    for name in names:
+        if name in CODECS:
+            return CODECS[name]
+    return JSON